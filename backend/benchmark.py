@@ -0,0 +1,399 @@
+"""
+Load benchmark for every endpoint of the trivia API.
+
+Seeds a synthetic dataset into the given database, builds the app through
+create_app and drives each route (paging depth, search terms, long quiz
+games, writes) through the Flask test client or a local WSGI server.
+Results are written as JSON with sorted keys, so runs can be diffed
+between commits:
+
+    python benchmark.py --database sqlite:////tmp/trivia_bench.db \\
+        --questions 100000 --categories 12 --output bench.json
+
+The database is dropped and re-seeded unless --skip-seed is given; never
+point it at a database whose data you want to keep.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+WORDS = (
+    'river mountain painter battle planet novel element king museum '
+    'ocean desert island emperor symphony orbit theorem glacier canyon '
+    'treaty dynasty comet volcano poet sculpture reactor cathedral '
+    'marathon stadium olympic league champion tournament'
+).split()
+
+SEARCH_TERMS = {
+    'search_common': 'river',
+    'search_rare': 'orbit theorem',
+    'search_missing': 'zzzzzz'
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default='sqlite:////tmp/trivia_bench.db',
+                        help='SQLAlchemy URI of the benchmark database')
+    parser.add_argument('--questions', type=int, default=1000,
+                        help='questions to seed (e.g. 1000, 100000, 1000000)')
+    parser.add_argument('--categories', type=int, default=6,
+                        help='categories to seed')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--quiz-rounds', type=int, default=50,
+                        help='questions asked per quiz game')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed for data and request parameters')
+    parser.add_argument('--transport', choices=('client', 'http'),
+                        default='client',
+                        help='Flask test client or a local WSGI server')
+    parser.add_argument('--scenario', action='append',
+                        help='only run the named scenario (repeatable)')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='reuse the data already in the database')
+    parser.add_argument('--output', help='write the JSON report to a file')
+    return parser.parse_args()
+
+
+# ---------------------------
+# Dataset
+# ---------------------------
+
+def seed(app, questions, categories, rng):
+    from models import db, Category, QuestionCount
+    from flaskr.bulk import import_questions
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for number in range(categories):
+            db.session.add(Category('Category {}'.format(number + 1)))
+        db.session.commit()
+        Category.invalidate_cache()
+
+        def rows():
+            for number in range(questions):
+                words = rng.sample(WORDS, 6)
+                yield number + 1, {
+                    'question': 'Which {} {} {} {} {}? #{}'.format(
+                        *words[:5], number),
+                    'answer': words[5].capitalize(),
+                    'difficulty': rng.randint(1, 5),
+                    'category': rng.randint(1, categories)
+                }
+
+        inserted, rejected, _ = import_questions(rows())
+        QuestionCount.rebuild()
+    return inserted
+
+
+# ---------------------------
+# Transports
+# ---------------------------
+
+class ClientTransport:
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body,
+                                    headers=headers)
+        data = response.get_data()
+        return response.status_code, response.headers, data
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.connection = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_port)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, payload, headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        return response.status, response.headers, data
+
+    def close(self):
+        self.connection.close()
+        self.server.shutdown()
+
+
+# ---------------------------
+# Scenarios
+# ---------------------------
+
+def scenarios(args, rng, max_id):
+    """
+    name -> callable(transport) issuing one logical request; each returns
+    the number of HTTP requests it made and whether they all succeeded.
+    """
+    per_page = 10
+    last_page = max(1, (args.questions + per_page - 1) // per_page)
+
+    def get(path, expect=(200,), headers=None):
+        def run(transport):
+            status, _, _ = transport.request('GET', path(), headers=headers)
+            return 1, status in expect
+        return run
+
+    def post(path, body, expect=(200,)):
+        def run(transport):
+            status, _, _ = transport.request('POST', path, body())
+            return 1, status in expect
+        return run
+
+    def conditional(transport):
+        status, headers, _ = transport.request('GET', '/categories')
+        status, _, _ = transport.request(
+            'GET', '/categories', headers={'If-None-Match': headers['ETag']})
+        return 2, status == 304
+
+    def quiz_stateless(transport):
+        # one whole game: previous_questions grows every round
+        previous = []
+        category = {'type': 'any', 'id': rng.randint(0, args.categories)}
+        for _ in range(args.quiz_rounds):
+            status, _, data = transport.request('POST', '/quizzes', {
+                'previous_questions': previous,
+                'quiz_category': category
+            })
+            if status != 200:
+                return len(previous) + 1, False
+            question = json.loads(data)['question']
+            if not question:
+                break
+            previous.append(question['id'])
+        return len(previous) + 1, True
+
+    def quiz_session(transport):
+        category = {'type': 'any', 'id': rng.randint(0, args.categories)}
+        status, _, data = transport.request(
+            'POST', '/quizzes/sessions', {'quiz_category': category})
+        if status != 200:
+            return 1, False
+        session_id = json.loads(data)['session_id']
+        for rounds in range(1, args.quiz_rounds + 1):
+            status, _, data = transport.request(
+                'POST', '/quizzes/sessions/{}/next'.format(session_id))
+            if status != 200:
+                return rounds + 1, False
+            if not json.loads(data)['question']:
+                break
+        transport.request('DELETE', '/quizzes/sessions/{}'.format(session_id))
+        return rounds + 2, True
+
+    def create_delete(transport):
+        status, _, data = transport.request('POST', '/questions', {
+            'question': 'Benchmark question?',
+            'answer': 'Yes',
+            'difficulty': 1,
+            'category': rng.randint(1, args.categories)
+        })
+        if status != 200:
+            return 1, False
+        question_id = json.loads(data)['created_question']['id']
+        status, _, _ = transport.request(
+            'DELETE', '/questions/{}'.format(question_id))
+        return 2, status == 200
+
+    def page_view_separate(transport):
+        # what a question list view costs as one request per part
+        ok = True
+        for path in ('/categories', '/questions?page=1', '/stats'):
+            status, _, _ = transport.request('GET', path)
+            ok = ok and status == 200
+        return 3, ok
+
+    def page_view_batch(transport):
+        status, _, _ = transport.request('POST', '/batch', {'operations': [
+            {'op': 'categories'},
+            {'op': 'list', 'args': {'page': 1}},
+            {'op': 'stats'}
+        ]})
+        return 1, status == 200
+
+    table = {
+        'categories': get(lambda: '/categories'),
+        'categories_conditional': conditional,
+        'stats': get(lambda: '/stats'),
+        'questions_first_page': get(lambda: '/questions?page=1'),
+        'questions_random_page': get(lambda: '/questions?page={}'.format(
+            rng.randint(1, last_page))),
+        'questions_deep_offset': get(lambda: '/questions?page={}'.format(
+            last_page)),
+        'questions_deep_keyset': get(lambda: '/questions?after_id={}'.format(
+            max(0, max_id - per_page))),
+        'category_listing': get(lambda: '/categories/{}/questions'.format(
+            rng.randint(1, args.categories)), expect=(200, 404)),
+        'quiz_stateless_game': quiz_stateless,
+        'quiz_session_game': quiz_session,
+        'create_delete': create_delete,
+        'export': get(lambda: '/questions/export'),
+        'page_view_separate': page_view_separate,
+        'page_view_bootstrap': get(lambda: '/bootstrap'),
+        'page_view_batch': page_view_batch
+    }
+    for name, term in SEARCH_TERMS.items():
+        table[name] = post('/questions/search', lambda term=term: {
+            'searchTerm': term})
+    return table
+
+
+def percentile(ordered, fraction):
+    # nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    rank = max(1, int(round(fraction * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run_scenario(run, transport, iterations):
+    latencies = []
+    requests = failures = 0
+    rss_before = rss_kb()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        count, ok = run(transport)
+        latencies.append((time.perf_counter() - begin) * 1000)
+        requests += count
+        failures += 0 if ok else 1
+    elapsed = time.perf_counter() - started
+    rss_after = rss_kb()
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'requests': requests,
+        'failures': failures,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        # resident memory the scenario left behind; the peak is process-wide
+        'rss_delta_kb': (rss_after - rss_before
+                         if None not in (rss_before, rss_after) else None)
+    }
+
+
+def rss_kb():
+    # current resident set size, where /proc is available
+    try:
+        with open('/proc/self/statm') as handle:
+            pages = int(handle.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    # settings.py reads the database from the environment at import time;
+    # rate limits would shed the benchmark's own traffic
+    os.environ['DATABASE_URL'] = args.database
+    os.environ.setdefault('ADMISSION_ENABLED', 'false')
+    from flaskr import create_app
+    from models import db, Question
+
+    app = create_app()
+    if not args.skip_seed:
+        started = time.perf_counter()
+        seed(app, args.questions, args.categories, rng)
+        print('seeded {} questions in {:.1f}s'.format(
+            args.questions, time.perf_counter() - started), file=sys.stderr)
+
+    with app.app_context():
+        max_id = db.session.query(db.func.max(Question.id)).scalar() or 0
+        dialect = db.engine.dialect.name
+
+    transport = (HttpTransport if args.transport == 'http'
+                 else ClientTransport)(app)
+    results = {}
+    try:
+        for name, run in sorted(scenarios(args, rng, max_id).items()):
+            if args.scenario and name not in args.scenario:
+                continue
+            iterations = args.requests
+            if name in ('export', 'quiz_stateless_game', 'quiz_session_game'):
+                # whole exports and whole games are heavy; run fewer
+                iterations = max(1, args.requests // 20)
+            results[name] = run_scenario(run, transport, iterations)
+            print('{:<24} p50 {:>9.3f} ms  p99 {:>9.3f} ms  {:>8.1f} req/s'
+                  .format(name, results[name]['p50_ms'],
+                          results[name]['p99_ms'],
+                          results[name]['requests_per_second']),
+                  file=sys.stderr)
+    finally:
+        transport.close()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'database': dialect,
+            'questions': args.questions,
+            'categories': args.categories,
+            'requests': args.requests,
+            'quiz_rounds': args.quiz_rounds,
+            'seed': args.seed,
+            'transport': args.transport,
+            'python': platform.python_version(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'peak_rss_kb': peak_rss_kb()
+        },
+        'scenarios': results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
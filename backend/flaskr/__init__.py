@@ -1,29 +1,133 @@
 import os
+import time
 from sre_constants import SUCCESS
 from unicodedata import category
-from flask import Flask, request, abort, jsonify, flash
+from flask import Flask, Response, request, abort, jsonify, flash, stream_with_context, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+import click
+from werkzeug.exceptions import HTTPException
 
-from models import setup_db, Question, Category
+from models import setup_db, use_replica, on_question_change, \
+    sync_data_versions, data_modified, db, database_path, Question, Category, \
+    QuestionCount, QuestionStat
+from querylog import slow_queries
+from settings import QUIZ_SESSION_LIMIT, QUIZ_SESSION_TTL, CACHE_CONTROL, \
+    METRICS_ENABLED, METRICS_SERVER_TIMING, COMPRESSION_ENABLED, \
+    COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL, COMPRESSION_CACHE_SIZE, \
+    ADMISSION_ENABLED, RATE_LIMITS, CONCURRENCY_LIMITS, \
+    ADMISSION_QUEUE_TIMEOUT, WRITE_BEHIND_ENABLED, WRITE_BEHIND_QUEUE_SIZE, \
+    WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_INTERVAL, RESULT_CACHE_SIZE, \
+    RESULT_CACHE_TTL, DATA_VERSION_POLL_INTERVAL, DATABASE_REPLICA_URL, \
+    CREATE_SCHEMA, WARM_START_SNAPSHOT, REPLICA_LAG_WINDOW, DEBUG_ENDPOINTS
+from .admission import init_admission
+from .batch import BatchRequest
+from .bulk import export_ndjson, import_questions, read_csv, read_ndjson, \
+    stream_questions_json, validate_question
+from .compression import init_compression
+from .conditional import conditional_get
+from .metrics import init_metrics
+from .quiz import QuizSampler, QuizSessionStore
+from .resultcache import SEARCH_TAG, ResultCache, category_tag
+from .search import TrigramIndex, search_questions
+from .snapshot import warm_start, write_snapshot
+from .serialization import json_response, project, requested_fields, \
+    rows_to_dicts
+from .writebehind import WriteBehindQueue
 
 QUESTIONS_PER_PAGE = 10
 
+# items accepted by one batch write (DELETE /questions, /questions/batch)
+BATCH_LIMIT = 1000
+
+# POST endpoints that only read, served by the read replica like GETs
+READ_ONLY_ENDPOINTS = ('find_questions', 'batch_read')
+
+# GET endpoints whose output does not follow the data version: no ETags,
+# no cached compressed bodies
+UNVERSIONED_ENDPOINTS = ('metrics_endpoint', 'write_behind_status',
+                         'write_behind_ticket', 'slow_queries_endpoint')
+
+# clients allowed to read the debug endpoints
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# read operations accepted by one POST /batch
+BATCH_OPERATIONS_LIMIT = 20
+
+# endpoints whose rate limits each POST /batch operation is charged to
+BATCH_ENDPOINTS = {
+    'categories': 'getall_categories',
+    'list': 'getall_questions',
+    'category': 'get_questions_by_category',
+    'search': 'find_questions',
+    'stats': 'get_stats'
+}
+
+# messages of the error handlers, also used by POST /batch results
+ERROR_MESSAGES = {
+    400: 'Bad request',
+    404: 'Page not found',
+    405: 'Invalid method!',
+    406: 'Not Acceptable',
+    422: 'Unprocessable resources',
+    429: 'Too many requests',
+    500: 'Internal server error',
+    503: 'Service unavailable'
+}
+
 # ---------------------------
 # Define question paginating
 # ---------------------------
 
 
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+def paginate_questions(request, selection, fields):
+    # paging happens in SQL: ?page=N maps to LIMIT/OFFSET while
+    # ?after_id=N walks the primary key (keyset), which stays cheap
+    # however deep the client pages. Only the requested fields are
+    # selected, as plain rows rather than Question objects
+    after_id = request.args.get('after_id', None, type=int)
+    selection, columns = project(selection, fields)
+    selection = selection.order_by(Question.id)
+
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    # fetch one extra row to learn whether another page follows
+    rows = selection.limit(QUESTIONS_PER_PAGE + 1).all()
+    current_questions = rows_to_dicts(
+        rows[:QUESTIONS_PER_PAGE], columns, fields)
+
+    next_cursor = None
+    if len(rows) > QUESTIONS_PER_PAGE:
+        next_cursor = rows[QUESTIONS_PER_PAGE - 1][0]
+
+    return current_questions, next_cursor
+
+
+def arg_flag(request, name, default=False):
+    # boolean query-string switch: ?name=1/true/yes or ?name=0/false/no
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() not in ('0', 'false', 'no')
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
 
-    return current_questions
+def include_total(request):
+    # totals cost an extra query; clients may skip it with ?include_total=0
+    return arg_flag(request, 'include_total', True)
+
+
+def stream_response(payload, selection, fields):
+    return Response(
+        stream_with_context(
+            stream_questions_json(payload, selection, fields)),
+        mimetype='application/json'
+    )
 
 # ---------------------------
 # Setup app
@@ -31,13 +135,67 @@ def paginate_questions(request, selection):
 
 
 def create_app(test_config=None):
-    # create and configure the app
+    # create and configure the app: test_config (a dict) overrides the
+    # settings read from the environment
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(
+        DATABASE_URL=database_path,
+        DATABASE_REPLICA_URL=DATABASE_REPLICA_URL,
+        CREATE_SCHEMA=CREATE_SCHEMA,
+        WARM_START_SNAPSHOT=WARM_START_SNAPSHOT,
+        DEBUG_ENDPOINTS=DEBUG_ENDPOINTS
+    )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    # the engines connect on the first request, not here
+    setup_db(app, app.config['DATABASE_URL'],
+             app.config['DATABASE_REPLICA_URL'],
+             create_schema=app.config['CREATE_SCHEMA'])
+
+    # latency / SQL / size metrics at /metrics; registered first so its
+    # timer spans every other request hook
+    metrics = init_metrics(app, server_timing=METRICS_SERVER_TIMING) \
+        if METRICS_ENABLED else None
 
     # CORS setup
     CORS(app)
 
+    # per-client rate limits (429) and per-route concurrency caps (503)
+    if ADMISSION_ENABLED:
+        admission = init_admission(
+            app, RATE_LIMITS, CONCURRENCY_LIMITS, ADMISSION_QUEUE_TIMEOUT)
+        if metrics is not None:
+            metrics.add_collector(admission.collector)
+
+    # shuffled quiz decks, one per running quiz session
+    quiz_sessions = QuizSessionStore(QUIZ_SESSION_LIMIT, QUIZ_SESSION_TTL)
+
+    # question ids by category and difficulty for POST /quizzes, kept
+    # current by question writes
+    quiz_sampler = QuizSampler()
+    on_question_change(quiz_sampler.apply, app)
+
+    # warm start: category map and quiz ids from a local snapshot. Only
+    # with the data_versions poll, which drops what changed since
+    if app.config['WARM_START_SNAPSHOT'] and DATA_VERSION_POLL_INTERVAL >= 0:
+        warm_start(app.config['WARM_START_SNAPSHOT'], quiz_sampler)
+
+    # trigram index serving search where pg_trgm is not available
+    question_index = TrigramIndex()
+    on_question_change(question_index.apply, app)
+
+    # search pages and category listings, dropped selectively on writes
+    results = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+    on_question_change(results.apply, app)
+    if metrics is not None:
+        metrics.add_collector(results.collector)
+
+    # optional write-behind queue for POST /questions
+    write_behind = WriteBehindQueue(
+        app, WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_BATCH_SIZE,
+        WRITE_BEHIND_INTERVAL) if WRITE_BEHIND_ENABLED else None
+
     # CORS headers set access control to allows
     @app.after_request
     def after_request(response):
@@ -49,6 +207,78 @@ def create_app(test_config=None):
         )
         return response
 
+    # writes of the other workers drop this worker's stale caches; checked
+    # before the ETag and cache lookups that depend on them
+    @app.before_request
+    def sync_versions():
+        sync_data_versions(DATA_VERSION_POLL_INTERVAL)
+
+    # reads go to the replica (when one is configured), writes to the
+    # primary. Right after a write the replica may not have it yet while
+    # the ETags and caches already carry the new version, so reads stay on
+    # the primary for REPLICA_LAG_WINDOW seconds
+    @app.before_request
+    def route_reads():
+        use_replica((request.method in ('GET', 'HEAD') or
+                     request.endpoint in READ_ONLY_ENDPOINTS) and
+                    time.time() - data_modified() >= REPLICA_LAG_WINDOW)
+
+    # ETag / Last-Modified / Cache-Control on GET, 304 on If-None-Match
+    conditional_get(app, CACHE_CONTROL, exempt=UNVERSIONED_ENDPOINTS)
+
+    # gzip / brotli above a size threshold, hot GET bodies kept compressed
+    if COMPRESSION_ENABLED:
+        compressed = init_compression(
+            app, COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL,
+            COMPRESSION_CACHE_SIZE, exempt=UNVERSIONED_ENDPOINTS)
+        if metrics is not None:
+            metrics.add_collector(compressed.collector)
+
+    # ---------------------------------------------
+    # CLI: flask create-schema
+    # ---------------------------------------------
+
+    @app.cli.command('create-schema')
+    def create_schema():
+        """Create the tables and indexes missing from the database."""
+        db.create_all()
+        click.echo('Created the missing tables')
+
+    # ---------------------------------------------
+    # CLI: flask write-snapshot [PATH]
+    # ---------------------------------------------
+
+    @app.cli.command('write-snapshot')
+    @click.argument('path', required=False)
+    def write_warm_start_snapshot(path):
+        """Write the warm-start snapshot (default: WARM_START_SNAPSHOT)."""
+        path = path or app.config['WARM_START_SNAPSHOT']
+        if not path:
+            raise click.UsageError('give a PATH or set WARM_START_SNAPSHOT')
+        snapshot = write_snapshot(path)
+        click.echo('Wrote {} categories and {} questions to {}'.format(
+            len(snapshot['categories']), len(snapshot['questions']), path))
+
+    # ---------------------------------------------
+    # CLI: flask rebuild-counts
+    # ---------------------------------------------
+
+    @app.cli.command('rebuild-counts')
+    def rebuild_counts():
+        """Recount the question counter cache from the questions table."""
+        total = QuestionCount.rebuild()
+        click.echo('Recounted {} questions'.format(total))
+
+    # ---------------------------------------------
+    # CLI: flask rebuild-stats
+    # ---------------------------------------------
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats():
+        """Recount the per category and difficulty statistics."""
+        total = QuestionStat.rebuild()
+        click.echo('Recounted statistics of {} questions'.format(total))
+
     # ---------------------------------------------
     # endpoint handle GET requests /all categories
     # ---------------------------------------------
@@ -58,11 +288,8 @@ def create_app(test_config=None):
         try:
             # by Default GET Method request
 
-            # get all categories
-            categories = Category.query.order_by(Category.id).all()
-
-            # dictionary to hold retrieved categories
-            categoryDict = {cat.id: cat.type for cat in categories}
+            # dictionary to hold retrieved categories (cached)
+            categoryDict = Category.as_map()
 
             # abort if no category found
             if len(categoryDict) == 0:
@@ -74,7 +301,39 @@ def create_app(test_config=None):
         return jsonify(
             success=True,
             categories=categoryDict,
-            total_categories=len(Category.query.all())
+            total_categories=len(categoryDict)
+        )
+
+    # -------------------------------------------------------------
+    # endpoint handle GET requests for question statistics: counts per
+    # category and difficulty, read from the question_stats aggregate
+    # -------------------------------------------------------------
+
+    @ app.route('/stats')
+    def get_stats():
+        # dictionary to hold categories (cached)
+        return jsonify(stats_payload(Category.as_map()))
+
+    def stats_payload(categoryDict):
+        categories = {cat_id: dict(id=cat_id, type=cat_type,
+                                   total_questions=0, difficulties={})
+                      for cat_id, cat_type in categoryDict.items()}
+        difficulties = {}
+        uncategorized = 0
+        for cat_id, difficulty, total in QuestionStat.all():
+            difficulties[difficulty] = difficulties.get(difficulty, 0) + total
+            if cat_id not in categories:
+                uncategorized += total
+                continue
+            categories[cat_id]['total_questions'] += total
+            categories[cat_id]['difficulties'][difficulty] = total
+
+        return dict(
+            success=True,
+            total_questions=sum(difficulties.values()),
+            categories=list(categories.values()),
+            difficulties=difficulties,
+            uncategorized=uncategorized
         )
 
     # -------------------------------------------------------------
@@ -83,20 +342,29 @@ def create_app(test_config=None):
 
     @ app.route('/questions')
     def getall_questions():
-        try:
-            # by Default GET Method request
+        # ?stream=1 writes the whole listing incrementally instead
+        if arg_flag(request, 'stream'):
+            return stream_response(dict(
+                success=True,
+                categories=Category.as_map(),
+                current_category='all available',
+                total_questions=Question.total()
+            ), Question.query, requested_fields(request))
 
-            # get all questions respect to pagination aspect of 10
-            selection = Question.query.order_by(Question.id).all()
-
-            # pagination
-            selected_questions = paginate_questions(request, selection)
+        # return success message
+        return json_response(questions_page(request))
 
-            # get all categories
-            categories = Category.query.order_by(Category.id).all()
+    def questions_page(req, categoryDict=None):
+        # ?fields=id,question narrows each question (400 on unknown names)
+        fields = requested_fields(req)
+        try:
+            # get all questions respect to pagination aspect of 10
+            selected_questions, next_cursor = paginate_questions(
+                req, Question.query, fields)
 
-            # dictionary to hold categories
-            categoryDict = {cat.id: cat.type for cat in categories}
+            # dictionary to hold categories (cached)
+            if categoryDict is None:
+                categoryDict = Category.as_map()
 
             # Abort if no questions found
             if len(selected_questions) == 0:
@@ -104,14 +372,16 @@ def create_app(test_config=None):
 
         except:
             abort(404)
-        # return success message
-        return jsonify(
+        payload = dict(
             success=True,
             questions=selected_questions,
-            total_questions=len(selection),
             categories=categoryDict,
-            current_category='all available'
+            current_category='all available',
+            next_cursor=next_cursor
         )
+        if include_total(req):
+            payload['total_questions'] = Question.total()
+        return payload
 
     # -------------------------------------------------
     # endpoint handle DELETE request using question_ID
@@ -134,7 +404,7 @@ def create_app(test_config=None):
         return jsonify(
             success=True,
             deleted_question=question.format(),
-            remaining_questions=len(Question.query.all())
+            remaining_questions=Question.total()
         )
 
     # ---------------------------------------------
@@ -143,6 +413,7 @@ def create_app(test_config=None):
 
     @ app.route("/questions", methods=['POST'])
     def new_question():
+        queued = False
         try:
             # Requesting data
             body = request.get_json()
@@ -157,27 +428,233 @@ def create_app(test_config=None):
             add_difficulty = body.get('difficulty', '')
             add_category = body.get('category', '')
 
+            # category and difficulty are integer columns; the category
+            # must exist (questions.category references categories.id)
+            if add_category != '' and add_difficulty != '':
+                add_category = int(add_category)
+                add_difficulty = int(add_difficulty)
+                if add_category not in Category.as_map():
+                    abort(406)
+
             # if not storing empty question continue...
             # raise error alert in frontend
             if not ((add_question == '') or (add_answer == '') or (add_difficulty == '') or (add_category == '')):
 
-                # Inserting ...
-                question = Question(
+                row = dict(
                     question=add_question,
                     answer=add_answer,
                     difficulty=add_difficulty,
                     category=add_category
                 )
 
-                # Storing ...
-                question.insert()
+                # write-behind: queued unless ?sync=1 asks for the id now
+                if write_behind is not None and not arg_flag(request, 'sync'):
+                    queued = True
+                else:
+                    # read-your-writes: queued rows go in first
+                    if write_behind is not None:
+                        write_behind.flush()
+
+                    # Inserting ...
+                    question = Question(**row)
+
+                    # Storing ...
+                    question.insert()
         except:
             abort(406)
+
+        if queued:
+            ticket = write_behind.submit(row)
+
+            # shed the write when the queue is full; clients retry later
+            if ticket is None:
+                abort(503)
+            return jsonify(
+                success=True,
+                queued=True,
+                ticket=ticket
+            ), 202
+
         # return a success message
         return jsonify(
             success=True,
             created_question=question.format(),
-            total_questions=len(Question.query.all())
+            total_questions=Question.total()
+        )
+
+    # ---------------------------------------------------------------
+    # endpoint handle GET requests for the write-behind queue: counters,
+    # last error, and the status of one queued question by ticket
+    # ---------------------------------------------------------------
+
+    @ app.route('/questions/write-behind')
+    def write_behind_status():
+        if write_behind is None:
+            return jsonify(success=True, enabled=False)
+        return jsonify(success=True, enabled=True, **write_behind.status())
+
+    @ app.route('/questions/write-behind/<ticket>')
+    def write_behind_ticket(ticket):
+        status = write_behind.ticket(ticket) if write_behind else None
+        if status is None:
+            abort(404)
+        return jsonify(success=True, ticket=ticket, **status)
+
+    # ---------------------------------------------------------------
+    # endpoint handle GET requests for the slow-query log; a 404 unless
+    # DEBUG_ENDPOINTS is on, and then still for clients that are not
+    # local (behind a proxy on the same host every client looks local)
+    # ---------------------------------------------------------------
+
+    @ app.route('/debug/slow-queries')
+    def slow_queries_endpoint():
+        if not app.config['DEBUG_ENDPOINTS'] or \
+                request.remote_addr not in LOCAL_ADDRESSES:
+            abort(404)
+
+        records = slow_queries.records()
+        return jsonify(
+            success=True,
+            threshold_ms=slow_queries.threshold_ms,
+            explain_rate=slow_queries.explain_rate,
+            total_queries=len(records),
+            queries=records
+        )
+
+    # ---------------------------------------------------------------
+    # endpoint handle DELETE requests for a list of question ids: one
+    # DELETE ... WHERE id IN, one transaction, a result per id
+    # ---------------------------------------------------------------
+
+    @ app.route("/questions", methods=['DELETE'])
+    def remove_questions():
+        body = request.get_json(silent=True) or {}
+        ids = body.get('ids')
+
+        # abort when no list of ids found
+        if not isinstance(ids, list) or not ids or len(ids) > BATCH_LIMIT:
+            abort(422)
+
+        results = []
+        wanted = []
+        for item in ids:
+            if isinstance(item, bool) or not isinstance(item, int):
+                results.append(dict(id=item, success=False,
+                                    error='invalid id'))
+            elif item in wanted:
+                results.append(dict(id=item, success=False,
+                                    error='duplicate id'))
+            else:
+                wanted.append(item)
+                results.append(dict(id=item))
+
+        try:
+            deleted = {row['id'] for row in Question.delete_many(wanted)}
+        except:
+            abort(422)
+
+        for result in results:
+            if 'success' not in result:
+                result['success'] = result['id'] in deleted
+                if not result['success']:
+                    result['error'] = 'not found'
+
+        # return success message
+        return jsonify(
+            success=True,
+            deleted=len(deleted),
+            results=results,
+            remaining_questions=Question.total()
+        )
+
+    # -----------------------------------------------------------------
+    # endpoint handle POST requests to create many questions: valid ones
+    # go in with one multi-row INSERT, invalid ones are reported
+    # -----------------------------------------------------------------
+
+    @ app.route("/questions/batch", methods=['POST'])
+    def new_questions():
+        body = request.get_json(silent=True)
+
+        # a bare array or {"questions": [...]}
+        items = body.get('questions') if isinstance(body, dict) else body
+        if not isinstance(items, list) or not items or \
+                len(items) > BATCH_LIMIT:
+            abort(422)
+
+        categories = Category.as_map()
+        results = []
+        rows = []
+        for index, item in enumerate(items):
+            try:
+                rows.append(validate_question(
+                    item if isinstance(item, dict) else None, categories))
+                results.append(dict(index=index))
+            except ValueError as error:
+                results.append(dict(index=index, success=False,
+                                    error=str(error)))
+
+        try:
+            created = iter(Question.insert_many(rows))
+        except:
+            abort(422)
+
+        for result in results:
+            if 'success' not in result:
+                result['success'] = True
+                result['id'] = next(created)['id']
+
+        # return a success message
+        return jsonify(
+            success=True,
+            created=len(rows),
+            results=results,
+            total_questions=Question.total()
+        )
+
+    # ----------------------------------------------------------
+    # endpoint handle GET requests to export all questions (NDJSON)
+    # ----------------------------------------------------------
+
+    @ app.route('/questions/export')
+    def export_questions():
+        # streamed from a server-side cursor, one JSON object per line
+        fields = requested_fields(request)
+        return Response(
+            stream_with_context(export_ndjson(fields)),
+            mimetype='application/x-ndjson'
+        )
+
+    # ---------------------------------------------------------------
+    # endpoint handle POST requests to import questions (NDJSON / CSV)
+    # ---------------------------------------------------------------
+
+    @ app.route('/questions/import', methods=['POST'])
+    def import_questions_file():
+        # the body is read line by line, never loaded as a whole
+        lines = (line.decode('utf-8') for line in request.stream)
+
+        if request.mimetype == 'text/csv':
+            rows = read_csv(lines)
+        elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            rows = read_ndjson(lines)
+        else:
+            abort(400)
+
+        try:
+            inserted, rejected, errors = import_questions(rows)
+        except ValueError:
+            # undecodable body or CSV without the expected header
+            abort(400)
+        except:
+            abort(422)
+
+        return jsonify(
+            success=True,
+            inserted=inserted,
+            rejected=rejected,
+            errors=errors,
+            total_questions=Question.total()
         )
 
     # -----------------------------------------------------------------
@@ -186,60 +663,202 @@ def create_app(test_config=None):
 
     @ app.route('/questions/search', methods=['POST'])
     def find_questions():
+        # return success message
+        return json_response(search_page(request))
+
+    def search_page(req):
+        fields = requested_fields(req)
         try:
             # Requesting data
-            body = request.get_json()
-            search_Term = Question.query.filter(
-                Question.question.ilike('%{}%'.format(body.get('searchTerm')))
-            ).all()
+            body = req.get_json()
+            search_Term = (body.get('searchTerm') or '').strip()
 
-            if not body.get('searchTerm'):
+            if not search_Term:
                 # abort when nothing inserted
                 abort(404)
 
-            # else paginate if exceed above 10
-            searched_questions = paginate_questions(request, search_Term)
+            # ranked, paginated in the database, answers on request;
+            # results are cached until a question is written
+            page = req.args.get('page', 1, type=int)
+            include_answers = bool(body.get('searchAnswers'))
+            key = ('find_questions', search_Term.lower(), include_answers,
+                   page, include_total(req), fields)
+            cached = results.get(key)
+            if cached is None:
+                generation = results.generation()
+                cached = search_questions(
+                    search_Term,
+                    page,
+                    QUESTIONS_PER_PAGE,
+                    include_answers=include_answers,
+                    with_total=include_total(req),
+                    fields=fields,
+                    index=question_index
+                )
+                results.put(key, cached, (SEARCH_TAG,), generation)
+            searched_questions, total = cached
         except:
             abort(404)
-        # return success message
-        return jsonify(
+
+        payload = dict(
             success=True,
             questions=searched_questions,
-            total_questions=len(search_Term),
             current_category='any'
         )
+        if total is not None:
+            payload['total_questions'] = total
+        return payload
     # -------------------------------------------------------------
     # endpoint handle GET requests get question based on category
     # -------------------------------------------------------------
 
     @ app.route('/categories/<int:cat_id>/questions')
     def get_questions_by_category(cat_id):
+        # ?stream=1 writes the whole category incrementally instead
+        if arg_flag(request, 'stream'):
+            if cat_id not in Category.as_map():
+                abort(404)
+            return stream_response(dict(
+                success=True,
+                current_category=cat_id,
+                total_questions=Question.total(cat_id)
+            ), Question.query.filter_by(category=cat_id),
+                requested_fields(request))
+
+        # return a success message
+        return json_response(category_page(request, cat_id))
+
+    def category_page(req, cat_id, categoryDict=None):
+        fields = requested_fields(req)
         try:
-            # By Default GET Method request
+            # unknown categories are answered from the cached map
+            if categoryDict is None:
+                categoryDict = Category.as_map()
+            if cat_id not in categoryDict:
+                abort(404)
+
             # Filter Question with the given Category id
             all_questions = Question.query.filter_by(
                 category=cat_id
-            ).all()
+            )
 
-            # pagination
-            selected_questions = paginate_questions(request, all_questions)
+            # pagination; pages are cached until the category is written
+            key = ('get_questions_by_category', cat_id,
+                   req.args.get('page', 1, type=int),
+                   req.args.get('after_id', None, type=int), fields)
+            cached = results.get(key)
+            if cached is None:
+                generation = results.generation()
+                cached = paginate_questions(req, all_questions, fields)
+                results.put(key, cached, (category_tag(cat_id),), generation)
+            selected_questions, next_cursor = cached
 
             # abort when no questions found
             if len(selected_questions) == 0:
                 abort(404)
-
-            # variable to hold formated question
-            questions = [qts.format() for qts in all_questions]
         except:
             abort(404)
-        # return a success message
-        return jsonify(
+        return dict(
             success=True,
             current_category=cat_id,
-            questions=questions,
-            total_questions=len(all_questions)
-
+            questions=selected_questions,
+            total_questions=Question.total(cat_id),
+            next_cursor=next_cursor
         )
+
+    # -------------------------------------------------------------------
+    # endpoint handle GET requests /bootstrap: what the frontend views load
+    # first (categories, a question page, statistics) in one response
+    # -------------------------------------------------------------------
+
+    @ app.route('/bootstrap')
+    def bootstrap():
+        # one category lookup shared by every part; ?page, ?fields and
+        # ?include_total apply to the questions, ?stats=0 leaves them out
+        categoryDict = Category.as_map()
+        payload = questions_page(request, categoryDict)
+        payload['total_categories'] = len(categoryDict)
+        if arg_flag(request, 'stats', True):
+            stats = stats_payload(categoryDict)
+            del stats['success']
+            payload['stats'] = stats
+
+        # return success message
+        return json_response(payload)
+
+    # -------------------------------------------------------------------
+    # endpoint handle POST requests /batch: several read operations in one
+    # request, sharing its database session and one category lookup
+    # -------------------------------------------------------------------
+
+    @ app.route('/batch', methods=['POST'])
+    def batch_read():
+        try:
+            # Requesting data
+            body = request.get_json()
+            operations = [BatchRequest(operation)
+                          for operation in body['operations']]
+        except:
+            abort(422)
+
+        # abort when empty or too long
+        if not 0 < len(operations) <= BATCH_OPERATIONS_LIMIT:
+            abort(422)
+
+        # dictionary to hold categories (cached), read once for all
+        categoryDict = Category.as_map()
+
+        # return success message
+        return json_response(dict(
+            success=True,
+            results=[run_operation(operation, categoryDict)
+                     for operation in operations]
+        ))
+
+    def run_operation(operation, categoryDict):
+        # {op, status, body}; a failing operation fails alone, its body
+        # being what the endpoint would have answered
+        try:
+            # each operation takes a token of its endpoint's rate limit,
+            # so batching cannot go past what direct calls are allowed
+            admission = current_app.extensions.get('admission')
+            endpoint = BATCH_ENDPOINTS.get(operation.op)
+            if admission is not None and endpoint is not None:
+                if admission.check_rate(request.remote_addr, endpoint):
+                    admission.reject(endpoint, 'rate_limited')
+                    abort(429)
+
+            if operation.op == 'categories':
+                body = dict(
+                    success=True,
+                    categories=categoryDict,
+                    total_categories=len(categoryDict)
+                )
+            elif operation.op == 'list':
+                body = questions_page(operation, categoryDict)
+            elif operation.op == 'category':
+                body = category_page(
+                    operation, int(operation.get_json()['category']),
+                    categoryDict)
+            elif operation.op == 'search':
+                body = search_page(operation)
+            elif operation.op == 'stats':
+                body = stats_payload(categoryDict)
+            else:
+                abort(400)
+        except HTTPException as error:
+            status = error.code
+        except (KeyError, TypeError, ValueError):
+            status = 422
+        else:
+            return dict(op=operation.op, status=200, body=body)
+
+        return dict(op=operation.op, status=status, body=dict(
+            success=False,
+            error=status,
+            message=ERROR_MESSAGES[status]
+        ))
+
     # ----------------------------------------------------------------------------------
     # endpoint handle POST requests to get questions to play with respect to categories
     # ----------------------------------------------------------------------------------
@@ -256,31 +875,106 @@ def create_app(test_config=None):
 
             # adding into variables
             quiz_cat = body.get('quiz_category')
-            last_questions = body.get('previous_questions')
+            last_questions = [int(question_id) for question_id
+                              in body.get('previous_questions')]
 
-            # category not mention filter all questions
-            question = Question.query.filter(
-                Question.id.notin_(last_questions)).all() if not quiz_cat['id'] else ''
+            # ids arrive as strings from the frontend; compare as integers
+            category_id = int(quiz_cat['id'] or 0)
 
-            # filter questions by category
-            if quiz_cat['id']:
-                question = Question.query.filter(
-                    Question.category == quiz_cat['id'], Question.id.notin_(last_questions)).all()
+            # optional: one difficulty, or relative weights per difficulty
+            difficulty = body.get('difficulty')
+            weights = body.get('difficulty_weights')
+            if difficulty is not None and weights is not None:
+                abort(422)
+            if difficulty is not None:
+                weights = {int(difficulty): 1}
+            elif weights is not None:
+                weights = {int(level): float(weight)
+                           for level, weight in weights.items()}
+                if not all(0 <= weight < float('inf')
+                           for weight in weights.values()):
+                    abort(422)
 
-            # random question else return nothing
-            new_question = random.choice(
-                question).format() if len(question) > 0 else ''
+            # weighted random question of the category else return nothing
+            question, remaining = quiz_sampler.draw(
+                category_id, last_questions, weights)
+            new_question = question.format() if question else ''
         except:
             abort(422)
         return jsonify(
             success=True,
             question=new_question,
             current_category=quiz_cat['id'],
-            remaining_question=len(question)
+            remaining_question=remaining
+        )
+
+    # ------------------------------------------------------------------
+    # endpoint handle POST requests to start a quiz session: the category
+    # deck is shuffled once, so clients no longer send previous_questions
+    # ------------------------------------------------------------------
+
+    @ app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        try:
+            # requesting data
+            body = request.get_json()
+
+            # abort when no data found
+            if not (body and 'quiz_category' in body):
+                abort(422)
+
+            # category id 0 (or none) plays every category
+            quiz_cat = int(body.get('quiz_category')['id'] or 0)
+
+            session_id, total = quiz_sessions.create(quiz_cat)
+        except:
+            abort(422)
+        return jsonify(
+            success=True,
+            session_id=session_id,
+            current_category=quiz_cat,
+            total_questions=total
         )
 
     # ----------------------------------------------------------------
-    # Expected error handlers includes [422, 404, 400, 405, 500, 406]
+    # endpoint handle POST requests to draw the next question of a quiz
+    # session
+    # ----------------------------------------------------------------
+
+    @ app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        try:
+            quiz_cat = quiz_sessions.category(session_id)
+            question, remaining = quiz_sessions.draw(session_id)
+        except KeyError:
+            # unknown or expired session
+            abort(404)
+
+        return jsonify(
+            success=True,
+            session_id=session_id,
+            question=question.format() if question else '',
+            current_category=quiz_cat,
+            remaining_question=remaining
+        )
+
+    # --------------------------------------------------
+    # endpoint handle DELETE requests to end a quiz session
+    # --------------------------------------------------
+
+    @ app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        if not quiz_sessions.discard(session_id):
+            abort(404)
+
+        return jsonify(
+            success=True,
+            session_id=session_id
+        )
+
+    # ---------------------------------------------------------------------
+    # Expected error handlers includes [422, 404, 400, 405, 500, 406, 429,
+    # 503]
     # ----------------------------------------------------------------
 
     @ app.errorhandler(422)
@@ -288,7 +982,7 @@ def create_app(test_config=None):
         return jsonify(
             success=False,
             error=422,
-            message='Unprocessable resources'
+            message=ERROR_MESSAGES[422]
         ), 422
 
     @ app.errorhandler(404)
@@ -296,7 +990,7 @@ def create_app(test_config=None):
         return jsonify(
             success=False,
             error=404,
-            message='Page not found'
+            message=ERROR_MESSAGES[404]
         ), 404
 
     @ app.errorhandler(400)
@@ -304,7 +998,7 @@ def create_app(test_config=None):
         return jsonify(
             success=False,
             error=400,
-            message='Bad request'
+            message=ERROR_MESSAGES[400]
         ), 400
 
     @ app.errorhandler(405)
@@ -312,7 +1006,7 @@ def create_app(test_config=None):
         return jsonify(
             success=False,
             error=405,
-            message='Invalid method!'
+            message=ERROR_MESSAGES[405]
         ), 405
 
     @ app.errorhandler(500)
@@ -320,7 +1014,7 @@ def create_app(test_config=None):
         return jsonify(
             success=False,
             error=500,
-            message='Internal server error'
+            message=ERROR_MESSAGES[500]
         ), 500
 
     @ app.errorhandler(406)
@@ -328,7 +1022,23 @@ def create_app(test_config=None):
         return jsonify(
             success=False,
             error=406,
-            message='Not Acceptable'
+            message=ERROR_MESSAGES[406]
         ), 406
 
+    @ app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify(
+            success=False,
+            error=429,
+            message=ERROR_MESSAGES[429]
+        ), 429
+
+    @ app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify(
+            success=False,
+            error=503,
+            message=ERROR_MESSAGES[503]
+        ), 503
+
     return app
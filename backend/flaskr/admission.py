@@ -0,0 +1,154 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort, g, request
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst tokens"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        # 0 when a token was taken, else seconds until the next one
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionControl:
+    """
+    Admits or sheds requests before their view runs.
+
+    rate_limits maps endpoint names to (rate, burst), rate above 0 and
+    burst at least 1: each client gets a token bucket per endpoint and
+    is answered 429 once it is empty.
+    concurrency_limits maps endpoint names to the most requests that may
+    run at once; a request waits up to queue_timeout seconds for a slot
+    and is answered 503 after that. Both carry Retry-After.
+    """
+
+    def __init__(self, rate_limits, concurrency_limits, queue_timeout,
+                 max_clients):
+        for endpoint, (rate, burst) in rate_limits.items():
+            if rate <= 0 or burst < 1:
+                raise ValueError('rate limit of {} needs a rate above 0 and '
+                                 'a burst of at least 1'.format(endpoint))
+        self.rate_limits = dict(rate_limits)
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self.concurrency = {endpoint: threading.BoundedSemaphore(limit)
+                            for endpoint, limit in concurrency_limits.items()}
+        self.in_flight = dict.fromkeys(concurrency_limits, 0)
+        self.rejected = {}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check_rate(self, client, endpoint):
+        limit = self.rate_limits.get(endpoint)
+        if limit is None:
+            return 0
+        key = (client, endpoint)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(*limit)
+                # forget the least recently seen clients
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take()
+
+    def enter(self, endpoint):
+        slots = self.concurrency.get(endpoint)
+        if slots is None:
+            return True
+        if not slots.acquire(timeout=self.queue_timeout):
+            return False
+        with self._lock:
+            self.in_flight[endpoint] += 1
+        return True
+
+    def leave(self, endpoint):
+        with self._lock:
+            self.in_flight[endpoint] -= 1
+        self.concurrency[endpoint].release()
+
+    def reject(self, endpoint, reason):
+        with self._lock:
+            key = (endpoint, reason)
+            self.rejected[key] = self.rejected.get(key, 0) + 1
+
+    def collector(self):
+        with self._lock:
+            rejected = sorted(self.rejected.items())
+            in_flight = sorted(self.in_flight.items())
+        return [
+            ('trivia_admission_rejected_total', 'counter',
+             'requests shed by admission control',
+             [({'endpoint': endpoint, 'reason': reason}, count)
+              for (endpoint, reason), count in rejected]),
+            ('trivia_admission_in_flight', 'gauge',
+             'requests running on concurrency-limited endpoints',
+             [({'endpoint': endpoint}, count)
+              for endpoint, count in in_flight])
+        ]
+
+
+def init_admission(app, rate_limits, concurrency_limits, queue_timeout=0.1,
+                   max_clients=10000):
+    """
+    Registers AdmissionControl on the app: rate limits are checked
+    first (429), then a concurrency slot is taken (503) and given back
+    when the request ends. Clients are told by remote address; behind a
+    proxy, wrap the app in werkzeug's ProxyFix.
+    """
+    control = AdmissionControl(rate_limits, concurrency_limits,
+                               queue_timeout, max_clients)
+    app.extensions['admission'] = control
+
+    @app.before_request
+    def admit():
+        endpoint = request.endpoint
+        if endpoint is None:
+            return
+
+        wait = control.check_rate(request.remote_addr, endpoint)
+        if wait:
+            control.reject(endpoint, 'rate_limited')
+            g.retry_after = max(1, int(math.ceil(wait)))
+            abort(429)
+
+        if not control.enter(endpoint):
+            control.reject(endpoint, 'overloaded')
+            g.retry_after = 1
+            abort(503)
+        if endpoint in control.concurrency:
+            g.admitted = endpoint
+
+    @app.after_request
+    def add_retry_after(response):
+        retry_after = g.get('retry_after')
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    @app.teardown_request
+    def release(error=None):
+        endpoint = g.pop('admitted', None)
+        if endpoint is not None:
+            control.leave(endpoint)
+
+    return control
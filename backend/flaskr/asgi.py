@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+
+from settings import ASGI_THREADS
+
+from . import create_app
+
+
+# ---------------------------------------------------------------
+# ASGI serving mode: the event loop owns the sockets (slow clients,
+# idle keep-alives, request bodies) and a2wsgi hands each request to
+# a bounded pool of worker threads that runs the Flask app, so a
+# burst of connections queues on the loop instead of pinning threads.
+# A request still holds its thread while it waits on the database:
+# the routes and the engine are synchronous
+# ---------------------------------------------------------------
+
+class AsgiAdapter(WSGIMiddleware):
+    """
+    a2wsgi's WSGIMiddleware on ASGI_THREADS worker threads, whose pool
+    is shut down when the server's lifespan ends.
+    """
+
+    def __init__(self, wsgi_app, threads=None):
+        super().__init__(input_terminated(wsgi_app),
+                         workers=threads or ASGI_THREADS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # waited for off the loop: streamed responses still
+                # running need it to write their last chunks
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def input_terminated(wsgi_app):
+    # a2wsgi's request body ends with the last ASGI body message, so
+    # werkzeug may read it as it is instead of through a LimitedStream,
+    # whose size-limited readline() that body does not support
+    def app(environ, start_response):
+        environ['wsgi.input_terminated'] = True
+        return wsgi_app(environ, start_response)
+    return app
+
+
+def create_asgi_app(test_config=None, threads=None):
+    return AsgiAdapter(create_app(test_config), threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the trivia API over ASGI with uvicorn.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes')
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run('flaskr.asgi:create_asgi_app', factory=True,
+                host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+from werkzeug.datastructures import MultiDict
+
+
+class BatchRequest:
+    """
+    One read operation of POST /batch, standing in for flask.request in
+    the read helpers it runs: the operation's "args" object is its query
+    string and the operation itself its JSON body.
+    """
+
+    def __init__(self, operation):
+        if not isinstance(operation, dict):
+            raise ValueError('an operation is a JSON object')
+        args = operation.get('args') or {}
+        if not isinstance(args, dict):
+            raise ValueError('args is a JSON object')
+        self.op = operation.get('op')
+        self.args = MultiDict({
+            key: str(value).lower() if isinstance(value, bool) else str(value)
+            for key, value in args.items()})
+        self._body = operation
+
+    def get_json(self):
+        return self._body
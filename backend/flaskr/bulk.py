@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+
+from models import db, Question, Category, bump_aggregates, \
+    question_changed, question_deltas
+from .serialization import QUESTION_FIELDS, dumps, project, rows_to_dicts
+
+EXPORT_BATCH = 1000
+IMPORT_CHUNK = 1000
+IMPORT_ERROR_LIMIT = 100
+IMPORT_COLUMNS = ('question', 'answer', 'difficulty', 'category')
+
+
+# ---------------------------------------------------------------
+# NDJSON export: rows come from a server-side cursor (psycopg2
+# named cursor) in batches, so memory stays flat for any table size
+# ---------------------------------------------------------------
+
+def iter_question_batches(selection=None, fields=QUESTION_FIELDS):
+    # questions of a Question query as dicts of the given fields,
+    # EXPORT_BATCH at a time
+    selection = selection if selection is not None else Question.query
+    selection, columns = project(selection, fields)
+    rows = selection.order_by(Question.id).execution_options(
+        stream_results=True).yield_per(EXPORT_BATCH)
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_BATCH:
+            yield rows_to_dicts(batch, columns, fields)
+            batch = []
+    if batch:
+        yield rows_to_dicts(batch, columns, fields)
+
+
+def export_ndjson(fields=QUESTION_FIELDS):
+    for batch in iter_question_batches(fields=fields):
+        yield b''.join(dumps(question) + b'\n' for question in batch)
+
+
+# ---------------------------------------------------------------
+# ?stream=1 listings: the payload is written first and the
+# "questions" array follows batch by batch, so a listing of any
+# size never sits in memory as a whole
+# ---------------------------------------------------------------
+
+def stream_questions_json(payload, selection, fields=QUESTION_FIELDS):
+    head = dumps(payload)
+    yield head[:-1] + (b',' if payload else b'') + b'"questions":['
+
+    separator = b''
+    for batch in iter_question_batches(selection, fields):
+        yield separator + b','.join(dumps(question) for question in batch)
+        separator = b','
+    yield b']}'
+
+
+# ---------------------------------------------------------------
+# NDJSON / CSV import: rows are validated and inserted chunk by
+# chunk (COPY on PostgreSQL, executemany elsewhere) inside a single
+# transaction, then the counter cache and statistics are bumped once
+# ---------------------------------------------------------------
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None
+            continue
+        yield number, row if isinstance(row, dict) else None
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or \
+            not set(IMPORT_COLUMNS) <= set(reader.fieldnames):
+        raise ValueError('CSV header must name {}'.format(
+            ', '.join(IMPORT_COLUMNS)))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def validate_question(row, categories):
+    # returns the insertable row or raises ValueError with the reason
+    if row is None:
+        raise ValueError('malformed row')
+
+    question = str(row.get('question') or '').strip()
+    answer = str(row.get('answer') or '').strip()
+    if not question or not answer:
+        raise ValueError('question and answer are required')
+
+    try:
+        difficulty = int(row.get('difficulty'))
+        category = int(row.get('category'))
+    except (TypeError, ValueError):
+        raise ValueError('difficulty and category must be integers')
+
+    if category not in categories:
+        raise ValueError('unknown category {}'.format(category))
+
+    return {
+        'question': question,
+        'answer': answer,
+        'difficulty': difficulty,
+        'category': category
+    }
+
+
+def import_questions(rows):
+    """
+    Validates and inserts (line number, row) pairs in one transaction.
+    Returns the number of inserted rows, the number of rejected rows and
+    the first IMPORT_ERROR_LIMIT rejections as {line, error}.
+    """
+    categories = Category.as_map()
+    inserted = rejected = 0
+    errors = []
+    deltas = {}
+    chunk = []
+
+    try:
+        for number, row in rows:
+            try:
+                chunk.append(validate_question(row, categories))
+            except ValueError as error:
+                rejected += 1
+                if len(errors) < IMPORT_ERROR_LIMIT:
+                    errors.append({'line': number, 'error': str(error)})
+                continue
+
+            if len(chunk) == IMPORT_CHUNK:
+                inserted += _insert_chunk(chunk, deltas)
+                chunk = []
+        if chunk:
+            inserted += _insert_chunk(chunk, deltas)
+
+        bump_aggregates(deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if inserted:
+        question_changed('reset')
+    return inserted, rejected, errors
+
+
+def _insert_chunk(chunk, deltas):
+    question_deltas(chunk, 1, deltas)
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow([row[column] for column in IMPORT_COLUMNS])
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            'COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                ', '.join(IMPORT_COLUMNS)), buffer)
+        cursor.close()
+    else:
+        connection.execute(Question.__table__.insert(), chunk)
+    return len(chunk)
@@ -0,0 +1,146 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import g, request
+
+from models import data_version
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson',
+                      'text/plain', 'text/csv', 'text/html')
+
+# preferred first; brotli only when the module is installed
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# precompressed bodies larger than this are not kept
+MAX_CACHED_BODY = 256 * 1024
+
+
+def negotiate(accept_encodings):
+    # the best encoding the client accepts, or None for identity
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        # brotli qualities run 0-11; gzip levels 1-9 map onto them
+        return brotli.compress(body, quality=min(11, level))
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class PrecompressedCache:
+    """
+    LRU of compressed GET bodies keyed by path, query string, data
+    version and encoding. Entries of an older data version can never be
+    hit again, so the whole cache is dropped when the version moves.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        version = key[2]
+        if version != data_version():
+            # written meanwhile; the body may already be out of date
+            return
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.limit:
+                self._entries.popitem(last=False)
+
+    def collector(self):
+        with self._lock:
+            stats = (('hits', self.hits), ('misses', self.misses),
+                     ('entries', len(self._entries)))
+        return [('trivia_compression_cache_{}'.format(key),
+                 'gauge' if key == 'entries' else 'counter',
+                 'precompressed response cache {}'.format(key),
+                 [({}, value)]) for key, value in stats]
+
+
+def init_compression(app, min_size, level, cache_size, exempt=()):
+    """
+    Compresses responses of COMPRESSIBLE_TYPES of at least min_size bytes
+    with the best encoding the client accepts (brotli, then gzip).
+    GET responses are also kept compressed in a PrecompressedCache of
+    cache_size entries and served from it before the view runs, so hot
+    pages skip both the queries and the compression. Endpoints in exempt
+    (whose output does not follow the data version) are never cached.
+    Register it after conditional_get, so a 304 still wins.
+    """
+    cache = PrecompressedCache(cache_size)
+
+    @app.before_request
+    def serve_precompressed():
+        if request.method != 'GET' or not cache.limit or \
+                request.url_rule is None or request.endpoint in exempt:
+            return None
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None:
+            return None
+
+        key = (request.path, request.query_string, data_version(), encoding)
+        entry = cache.get(key)
+        if entry is None:
+            g.precompress_key = key
+            return None
+
+        body, mimetype = entry
+        response = app.response_class(body, mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code != 200 or response.is_streamed or \
+                response.direct_passthrough or \
+                'Content-Encoding' in response.headers or \
+                response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        body = response.get_data()
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None or len(body) < min_size:
+            return response
+
+        body = compress(body, encoding, level)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+
+        key = g.get('precompress_key')
+        if key is not None and len(body) <= MAX_CACHED_BODY:
+            cache.put(key, (body, response.mimetype))
+        return response
+
+    return cache
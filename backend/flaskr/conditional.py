@@ -0,0 +1,58 @@
+from flask import g, request
+
+from models import data_version, data_modified
+
+DEFAULT_CACHE_CONTROL = 'no-cache'
+
+
+def conditional_get(app, cache_control, exempt=()):
+    """
+    Adds a strong ETag, Last-Modified and Cache-Control to every GET
+    response built from the data, and answers a matching If-None-Match
+    with 304 before the view runs, so no query is made at all.
+
+    cache_control maps endpoint names to their Cache-Control value;
+    other endpoints send DEFAULT_CACHE_CONTROL. Endpoints in exempt
+    (whose output does not follow the data version) are left alone.
+
+    Content-coded responses get their own ETag ("<version>-gzip"), as
+    the gzip and identity bodies differ; any coding of the current
+    version satisfies If-None-Match.
+    """
+
+    def is_conditional():
+        rule = request.url_rule
+        return request.method in ('GET', 'HEAD') and rule is not None \
+            and request.endpoint != 'static' \
+            and request.endpoint not in exempt
+
+    @app.before_request
+    def check_etag():
+        if not is_conditional():
+            return None
+
+        g.etag = data_version()
+        for tag in request.if_none_match.as_set():
+            if tag == g.etag or tag.startswith(g.etag + '-'):
+                g.etag_matched = tag
+                response = app.response_class(status=304)
+                add_validators(response)
+                return response
+        return None
+
+    @app.after_request
+    def add_validators(response):
+        etag = g.get('etag')
+        if etag is None or response.status_code not in (200, 304):
+            return response
+
+        encoding = response.headers.get('Content-Encoding')
+        if response.status_code == 304:
+            etag = g.get('etag_matched', etag)
+        elif encoding:
+            etag = '{}-{}'.format(etag, encoding)
+        response.set_etag(etag)
+        response.last_modified = data_modified()
+        response.headers['Cache-Control'] = cache_control.get(
+            request.endpoint, DEFAULT_CACHE_CONTROL)
+        return response
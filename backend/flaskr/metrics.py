@@ -0,0 +1,210 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import Category
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    """Cumulative Prometheus histogram; callers hold the registry lock."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, self.count)
+
+
+class Metrics:
+    """
+    Per route and method request metrics, rendered as Prometheus text.
+
+    Extra collectors registered with add_collector() return
+    (name, type, help, [(labels dict, value)]) tuples for subsystems
+    that keep their own counters (caches, admission control).
+    """
+
+    HISTOGRAMS = (
+        ('trivia_request_duration_seconds', 'request latency',
+         LATENCY_BUCKETS),
+        ('trivia_request_sql_statements', 'SQL statements per request',
+         STATEMENT_BUCKETS),
+        ('trivia_request_db_seconds', 'database time per request',
+         LATENCY_BUCKETS),
+        ('trivia_response_size_bytes', 'response body size', SIZE_BUCKETS),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+        self._requests = {}
+        self._collectors = []
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def observe(self, route, method, status, seconds, statements,
+                db_seconds, size):
+        key = (route, method)
+        values = (seconds, statements, db_seconds, size)
+        with self._lock:
+            status_key = key + (status,)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            for (name, _, buckets), value in zip(self.HISTOGRAMS, values):
+                if value is None:
+                    continue
+                histograms = self._histograms[name]
+                if key not in histograms:
+                    histograms[key] = Histogram(buckets)
+                histograms[key].observe(value)
+
+    def render(self):
+        lines = [
+            '# HELP trivia_requests_total requests by route, method and status',
+            '# TYPE trivia_requests_total counter'
+        ]
+        with self._lock:
+            for (route, method, status), count in sorted(
+                    self._requests.items()):
+                lines.append(
+                    'trivia_requests_total{{{},status="{}"}} {}'.format(
+                        _labels(route, method), status, count))
+
+            for name, help_text, _ in self.HISTOGRAMS:
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} histogram'.format(name))
+                for (route, method), histogram in sorted(
+                        self._histograms[name].items()):
+                    lines.extend(histogram.samples(
+                        name, _labels(route, method)))
+
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for labels, value in samples:
+                    label_text = ','.join('{}="{}"'.format(
+                        key, _escape(value)) for key, value in labels.items())
+                    lines.append('{}{{{}}} {}'.format(name, label_text, value)
+                                 if label_text else
+                                 '{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+def category_cache_collector():
+    return [('trivia_category_cache_{}_total'.format(key), 'counter',
+             'category map cache {}'.format(key), [({}, value)])
+            for key, value in sorted(Category.cache_stats().items())]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _labels(route, method):
+    return 'route="{}",method="{}"'.format(_escape(route), method)
+
+
+# ---------------------------------------------------------------
+# SQL statements and database time of the current request, counted
+# from engine events on every engine (primary and replica)
+# ---------------------------------------------------------------
+
+_sql = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    # statements on one connection run one at a time
+    conn.info['trivia_query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if getattr(_sql, 'active', False):
+        _sql.statements += 1
+        _sql.seconds += time.perf_counter() - \
+            conn.info['trivia_query_start']
+
+
+def _reset_sql_counters():
+    _sql.active = True
+    _sql.statements = 0
+    _sql.seconds = 0.0
+
+
+def init_metrics(app, server_timing=False):
+    """
+    Records latency, SQL statement count, database time and response size
+    of every request and serves them as Prometheus text at /metrics. With
+    server_timing, responses also carry a Server-Timing header. Register
+    it before other hooks so its timer spans them.
+    """
+    metrics = Metrics()
+    metrics.add_collector(category_cache_collector)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        _reset_sql_counters()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+
+        seconds = time.perf_counter() - started
+        statements = _sql.statements
+        db_seconds = _sql.seconds
+        _sql.active = False
+
+        rule = request.url_rule
+        metrics.observe(
+            rule.rule if rule is not None else 'unmatched',
+            request.method,
+            response.status_code,
+            seconds,
+            statements,
+            db_seconds,
+            response.calculate_content_length()
+        )
+
+        if server_timing:
+            response.headers['Server-Timing'] = \
+                'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+                    db_seconds * 1000, statements, seconds * 1000)
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4')
+
+    return metrics
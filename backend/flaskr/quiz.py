@@ -0,0 +1,278 @@
+import random
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+from models import db, Question, ALL_CATEGORIES
+
+
+class QuizSessionStore:
+    """
+    Bounded, expiring in-process store of quiz decks.
+
+    A deck is the shuffled list of question ids of one category, built once
+    when the session starts; every draw pops one id and loads that single
+    row by primary key. Idle sessions expire after ``ttl`` seconds and the
+    least recently used one is evicted once ``limit`` sessions are held.
+    """
+
+    def __init__(self, limit, ttl):
+        self.limit = limit
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, category_id=None):
+        query = db.session.query(Question.id)
+        if category_id:
+            query = query.filter(Question.category == category_id)
+
+        # ids are kept in a compact int array rather than a list of objects
+        ids = [row.id for row in query]
+        random.shuffle(ids)
+        deck = array('l', ids)
+
+        session_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._sessions[session_id] = {
+                'deck': deck,
+                'category': category_id,
+                'expires': now + self.ttl
+            }
+            while len(self._sessions) > self.limit:
+                self._sessions.popitem(last=False)
+
+        return session_id, len(deck)
+
+    def draw(self, session_id):
+        # returns (question or None when the deck is empty, remaining ids);
+        # raises KeyError for unknown or expired sessions
+        while True:
+            with self._lock:
+                session = self._touch(session_id)
+                if not session['deck']:
+                    return None, 0
+                question_id = session['deck'].pop()
+                remaining = len(session['deck'])
+
+            # questions deleted since the deck was built are skipped
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question, remaining
+
+    def category(self, session_id):
+        with self._lock:
+            return self._touch(session_id)['category']
+
+    def discard(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _touch(self, session_id):
+        now = time.monotonic()
+        session = self._sessions[session_id]
+        if session['expires'] <= now:
+            del self._sessions[session_id]
+            raise KeyError(session_id)
+        session['expires'] = now + self.ttl
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _expire(self, now):
+        # sessions are kept in last-used order, so expired ones are in front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session['expires'] > now:
+                break
+            del self._sessions[session_id]
+
+
+class AliasTable:
+    """
+    Walker's alias method: built in O(n) from n positive weights, draw()
+    then returns index i with probability weights[i] / sum(weights) in
+    O(1), with one uniform slot and one biased coin.
+    """
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+
+        small = [i for i, share in enumerate(scaled) if share < 1]
+        large = [i for i, share in enumerate(scaled) if share >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+    def draw(self):
+        slot = random.randrange(len(self.probability))
+        if random.random() < self.probability[slot]:
+            return slot
+        return self.alias[slot]
+
+
+class Bucket:
+    """ids in a compact int array, with each id's position in it"""
+
+    def __init__(self):
+        self.ids = array('l')
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id):
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+
+    def remove(self, question_id):
+        # the last id fills the hole, so removal is O(1)
+        position = self.positions.pop(question_id)
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self.positions[last] = position
+
+
+class QuizSampler:
+    """
+    Question ids bucketed by category and difficulty, for POST /quizzes.
+
+    Every category, and ALL_CATEGORIES, holds one Bucket per difficulty
+    (0 for questions without one). The buckets are loaded with a single
+    query on the first draw and after a 'reset' or 'stale' change; other
+    question writes reported through on_question_change move single ids.
+
+    A draw picks a difficulty with an AliasTable over the weights, then a
+    uniform id of that bucket. Already asked ids are located by their
+    positions and stepped over, so the bucket is never scanned.
+    """
+
+    def __init__(self):
+        self._buckets = None
+        self._questions = None
+        self._lock = threading.Lock()
+
+    def draw(self, category_id=None, excluded=(), weights=None):
+        """
+        Returns (question or None, number of questions it was drawn
+        from). weights maps difficulties to relative weights; without it
+        every question not yet asked is equally likely.
+        """
+        excluded = set(excluded)
+        while True:
+            with self._lock:
+                self._ensure_built()
+                question_id, candidates = self._pick(
+                    category_id or ALL_CATEGORIES, excluded, weights)
+            if question_id is None:
+                return None, candidates
+
+            # questions deleted since the buckets were loaded are dropped
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question, candidates
+            with self._lock:
+                if self._questions is not None:
+                    self._remove(question_id)
+
+    def apply(self, action, before, after):
+        # on_question_change listener
+        if action in ('reset', 'stale'):
+            self.clear()
+            return
+        with self._lock:
+            if self._buckets is None:
+                return
+            if before is not None:
+                self._remove(before['id'])
+            if after is not None:
+                self._add(after['id'], after['category'],
+                          after['difficulty'])
+
+    def clear(self):
+        with self._lock:
+            self._buckets = None
+            self._questions = None
+
+    def load(self, rows):
+        # (id, category, difficulty) rows, e.g. from a warm-start snapshot
+        with self._lock:
+            self._load(rows)
+
+    def _pick(self, category_id, excluded, weights):
+        levels = self._buckets.get(category_id, {})
+
+        # positions of the asked ids, per difficulty of this category
+        skipped = {}
+        for question_id in excluded:
+            found = self._questions.get(question_id)
+            bucket = levels.get(found[1]) if found is not None else None
+            if bucket is not None and question_id in bucket.positions:
+                skipped.setdefault(found[1], []).append(
+                    bucket.positions[question_id])
+
+        remaining = {difficulty: len(bucket) - len(skipped.get(difficulty, ()))
+                     for difficulty, bucket in levels.items()}
+        if weights is None:
+            weights = remaining
+        choices = sorted((difficulty, weight)
+                         for difficulty, weight in weights.items()
+                         if weight > 0 and remaining.get(difficulty))
+        candidates = sum(remaining[difficulty] for difficulty, _ in choices)
+        if not choices:
+            return None, candidates
+
+        difficulty = choices[AliasTable(
+            [weight for _, weight in choices]).draw()][0]
+        index = random.randrange(remaining[difficulty])
+        for position in sorted(skipped.get(difficulty, ())):
+            if position > index:
+                break
+            index += 1
+        return levels[difficulty].ids[index], candidates
+
+    def _ensure_built(self):
+        if self._buckets is not None:
+            return
+        self._load(db.session.query(
+            Question.id, Question.category, Question.difficulty))
+
+    def _load(self, rows):
+        self._buckets = {}
+        self._questions = {}
+        for question_id, category, difficulty in rows:
+            self._add(question_id, category, difficulty)
+
+    def _add(self, question_id, category, difficulty):
+        if question_id in self._questions:
+            self._remove(question_id)
+        category, difficulty = int(category or 0), int(difficulty or 0)
+        self._questions[question_id] = (category, difficulty)
+        for key in {ALL_CATEGORIES, category}:
+            levels = self._buckets.setdefault(key, {})
+            levels.setdefault(difficulty, Bucket()).add(question_id)
+
+    def _remove(self, question_id):
+        found = self._questions.pop(question_id, None)
+        if found is None:
+            return
+        category, difficulty = found
+        for key in {ALL_CATEGORIES, category}:
+            levels = self._buckets[key]
+            levels[difficulty].remove(question_id)
+            if not levels[difficulty]:
+                del levels[difficulty]
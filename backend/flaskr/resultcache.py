@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+SEARCH_TAG = 'search'
+
+
+def category_tag(category):
+    return 'category:{}'.format(category)
+
+
+class ResultCache:
+    """
+    LRU cache of computed results with a time to live, for search pages
+    and category listings.
+
+    Every entry carries tags; a question write drops the entries tagged
+    with the categories it touched plus every search entry, and leaves
+    the rest. Results computed while a write happened are not stored:
+    callers take a generation() before computing and pass it to put().
+    """
+
+    def __init__(self, limit, ttl):
+        self.limit = limit
+        self.ttl = ttl
+        self.stats = dict.fromkeys(
+            ('hits', 'misses', 'evictions', 'expirations', 'invalidations'),
+            0)
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and \
+                    time.monotonic() >= entry[0]:
+                self._remove(key)
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[2]
+
+    def generation(self):
+        return self._generation
+
+    def put(self, key, value, tags, generation):
+        if not self.limit:
+            return
+        with self._lock:
+            if generation != self._generation:
+                # a write landed while the value was computed
+                return
+            if key in self._entries:
+                self._remove(key)
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = (expires, tags, value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.limit:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+
+    def apply(self, action, before, after):
+        # on_question_change listener
+        if action == 'reset':
+            self.clear()
+            return
+        tags = {SEARCH_TAG}
+        for question in (before, after):
+            if question is not None:
+                tags.add(category_tag(question['category']))
+        self.invalidate(tags)
+
+    def collector(self):
+        with self._lock:
+            stats = sorted(self.stats.items())
+            entries = len(self._entries)
+        return [('trivia_result_cache_{}_total'.format(key), 'counter',
+                 'result cache {}'.format(key), [({}, value)])
+                for key, value in stats] + [
+            ('trivia_result_cache_entries', 'gauge', 'result cache entries',
+             [({}, entries)])]
+
+    def _remove(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,235 @@
+import re
+import threading
+
+from markupsafe import escape
+from sqlalchemy import func, or_
+
+from models import db, Question
+from .serialization import QUESTION_FIELDS, project, rows_to_dicts, \
+    select_fields
+
+SEARCH_FIELDS = ('question', 'answer')
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    In-process trigram inverted index over question and answer text.
+
+    It answers the same case-insensitive substring queries as the pg_trgm
+    indexes do on PostgreSQL, for SQLite and test databases: the postings
+    of the term's trigrams are intersected and the few candidates left are
+    checked for the substring. It is built lazily on the first search and
+    kept current through on_question_change; create_app keeps one per app.
+    """
+
+    def __init__(self):
+        self._docs = None
+        self._postings = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def search(self, term, fields):
+        # returns matching ids, most relevant first
+        docs, all_postings = self._ensure_built()
+        term = term.lower()
+        grams = trigrams(term)
+
+        with self._lock:
+            if grams:
+                candidates = None
+                for field in fields:
+                    postings = all_postings[field]
+                    found = set.intersection(
+                        *(postings.get(gram, set()) for gram in grams))
+                    candidates = found if candidates is None \
+                        else candidates | found
+            else:
+                # terms shorter than a trigram fall back to a scan
+                candidates = set(docs)
+
+            ranked = []
+            for question_id in candidates:
+                doc = docs[question_id]
+                ranks = [similarity(grams, doc[field]['grams'])
+                         for field in fields
+                         if term in doc[field]['text']]
+                if ranks:
+                    ranked.append((-max(ranks), question_id))
+
+        return [question_id for _, question_id in sorted(ranked)]
+
+    def apply(self, action, before, after):
+        # 'stale' names no rows, so the index is rebuilt like on 'reset'
+        if action in ('reset', 'stale'):
+            self.clear()
+            return
+        with self._lock:
+            self._generation += 1
+            if self._docs is None:
+                return
+            if before is not None:
+                self._remove(before['id'])
+            if after is not None:
+                _index_question(self._docs, self._postings, after['id'],
+                                after['question'], after['answer'])
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._docs = None
+            self._postings = None
+
+    def _ensure_built(self):
+        # (docs, postings); the rows are read outside the lock, so a cold
+        # build does not hold up other searches, and an index that a write
+        # overtook while it was read is built again
+        while True:
+            with self._lock:
+                if self._docs is not None:
+                    return self._docs, self._postings
+                generation = self._generation
+
+            docs = {}
+            postings = {field: {} for field in SEARCH_FIELDS}
+            for row in db.session.query(
+                    Question.id, Question.question, Question.answer):
+                _index_question(docs, postings, row.id, row.question,
+                                row.answer)
+
+            with self._lock:
+                if self._docs is not None:
+                    return self._docs, self._postings
+                if generation == self._generation:
+                    self._docs, self._postings = docs, postings
+                    return docs, postings
+
+    def _remove(self, question_id):
+        doc = self._docs.pop(question_id, None)
+        if doc is None:
+            return
+        for field in SEARCH_FIELDS:
+            postings = self._postings[field]
+            for gram in trigrams(doc[field]['text']):
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(question_id)
+                    if not ids:
+                        del postings[gram]
+
+
+def _index_question(docs, postings, question_id, question, answer):
+    doc = {}
+    for field, text in zip(SEARCH_FIELDS, (question, answer)):
+        text = (text or '').lower()
+        grams = trigrams(text)
+        doc[field] = {'text': text, 'grams': len(grams)}
+        field_postings = postings[field]
+        for gram in grams:
+            field_postings.setdefault(gram, set()).add(question_id)
+    docs[question_id] = doc
+
+
+def similarity(term_grams, text_grams):
+    # share of the text's trigrams covered by the term, the same ordering
+    # pg_trgm's similarity() gives for texts containing the term
+    if not term_grams:
+        return 0.0
+    return len(term_grams) / float(max(text_grams, len(term_grams)))
+
+
+
+# -----------------------------------------------------------------
+# PostgreSQL: ILIKE is served by the gin_trgm_ops indexes and ranked
+# with similarity(); without pg_trgm the query still works unranked
+# -----------------------------------------------------------------
+
+_trigram_support = {}
+
+
+def has_trigram_support():
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return False
+    key = str(engine.url)
+    if key not in _trigram_support:
+        _trigram_support[key] = db.session.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+        ).scalar() is not None
+    return _trigram_support[key]
+
+
+def _like_pattern(term):
+    escaped = re.sub(r'([\\%_])', r'\\\1', term)
+    return '%{}%'.format(escaped)
+
+
+def search_questions(term, page, per_page, include_answers=False,
+                     with_total=True, fields=QUESTION_FIELDS, index=None):
+    """
+    Returns one page of questions containing ``term`` (most relevant
+    first, each with a ``highlights`` entry) and the total match count,
+    or None for the total when ``with_total`` is false. Only ``fields``
+    and the searched text are selected, as plain rows. Databases other
+    than PostgreSQL are searched through ``index``, a TrigramIndex.
+    """
+    searched = SEARCH_FIELDS if include_answers else SEARCH_FIELDS[:1]
+    selected = tuple(dict.fromkeys(fields + searched))
+    if page < 1:
+        return [], 0 if with_total else None
+
+    if db.engine.dialect.name == 'postgresql':
+        pattern = _like_pattern(term)
+        columns = [getattr(Question, field) for field in searched]
+        selection = Question.query.filter(
+            or_(*(column.ilike(pattern, escape='\\') for column in columns)))
+
+        ordering = [Question.id]
+        if has_trigram_support():
+            ranks = [func.similarity(column, term) for column in columns]
+            rank = ranks[0] if len(ranks) == 1 else func.greatest(*ranks)
+            ordering.insert(0, rank.desc())
+
+        rows, row_columns = project(selection, selected)
+        rows = rows.order_by(*ordering).offset(
+            (page - 1) * per_page).limit(per_page).all()
+        total = None
+        if with_total:
+            total = selection.with_entities(
+                func.count(Question.id)).scalar()
+    else:
+        ids = index.search(term, searched)
+        page_ids = ids[(page - 1) * per_page:page * per_page]
+        selection, row_columns = project(
+            Question.query.filter(Question.id.in_(page_ids)), selected)
+        found = {row[0]: row for row in selection} if page_ids else {}
+        rows = [found[question_id] for question_id in page_ids
+                if question_id in found]
+        total = len(ids) if with_total else None
+
+    return [select_fields(highlight(question, term, searched), fields)
+            for question in rows_to_dicts(rows, row_columns, selected)], total
+
+
+def highlight(formatted, term, fields):
+    # wraps every case-insensitive occurrence of the term in <mark>
+    pattern = re.compile(re.escape(term), re.IGNORECASE)
+    highlights = {}
+    for field in fields:
+        text = formatted[field] or ''
+        if not pattern.search(text):
+            continue
+        parts = []
+        last = 0
+        for match in pattern.finditer(text):
+            parts.append(escape(text[last:match.start()]))
+            parts.append('<mark>{}</mark>'.format(escape(match.group())))
+            last = match.end()
+        parts.append(escape(text[last:]))
+        highlights[field] = ''.join(parts)
+    formatted['highlights'] = highlights
+    return formatted
@@ -0,0 +1,83 @@
+import json
+
+from flask import Response, abort
+
+from models import Question, QUESTION_COLUMNS
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+QUESTION_FIELDS = QUESTION_COLUMNS
+
+
+# ---------------------------------------------------------------
+# JSON encoding: orjson when it is installed, the standard library
+# otherwise. Both produce compact UTF-8 with keys in insertion order
+# and integer keys (the category map) written as strings
+# ---------------------------------------------------------------
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+
+def json_backend():
+    return 'orjson' if orjson is not None else 'json'
+
+
+def json_response(payload, status=200):
+    # jsonify() replacement for listings, encoded with dumps()
+    return Response(dumps(payload) + b'\n', status=status,
+                    mimetype='application/json')
+
+
+# ---------------------------------------------------------------
+# Sparse fieldsets and column projection: listings select only the
+# requested columns as plain tuples, skipping ORM objects and the
+# session identity map entirely
+# ---------------------------------------------------------------
+
+def requested_fields(request, allowed=QUESTION_FIELDS):
+    """
+    The question fields named by ?fields=id,question (all of them when
+    absent), in the order given. Unknown names abort with 400.
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return allowed
+
+    fields = tuple(dict.fromkeys(
+        name.strip() for name in value.split(',') if name.strip()))
+    if not fields or not set(fields) <= set(allowed):
+        abort(400)
+    return fields
+
+
+def project(selection, fields):
+    # the id always comes first: keyset cursors and ordering need it
+    columns = ('id',) + tuple(field for field in fields if field != 'id')
+    return selection.with_entities(
+        *(getattr(Question, column) for column in columns)), columns
+
+
+def rows_to_dicts(rows, columns, fields):
+    if columns == fields:
+        return [dict(zip(fields, row)) for row in rows]
+    positions = [columns.index(field) for field in fields]
+    return [{field: row[position]
+             for field, position in zip(fields, positions)}
+            for row in rows]
+
+
+def select_fields(formatted, fields):
+    # sparse fieldset of an already formatted question
+    if len(fields) == len(QUESTION_FIELDS):
+        return formatted
+    return {key: value for key, value in formatted.items()
+            if key in fields or key not in QUESTION_FIELDS}
@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+from models import db, expect_data_versions, Category, DataVersion, Question
+
+SNAPSHOT_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def write_snapshot(path):
+    """
+    Writes the data a fresh worker would otherwise load on its first
+    requests to path as JSON: the data versions, the category map and the
+    (id, category, difficulty) rows of the quiz sampler. The versions are
+    read first, so a write landing meanwhile shows up as a newer version
+    and the worker drops what it touched. The file is replaced atomically.
+    """
+    versions = DataVersion.current()
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'created': time.time(),
+        'versions': versions,
+        'categories': {category.id: category.type for category in
+                       db.session.query(Category.id, Category.type)},
+        'questions': [list(row) for row in db.session.query(
+            Question.id, Question.category, Question.difficulty).order_by(
+                Question.id)]
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as output:
+            json.dump(snapshot, output, separators=(',', ':'))
+        os.replace(temporary, path)
+    except Exception:
+        os.unlink(temporary)
+        raise
+    return snapshot
+
+
+def read_snapshot(path):
+    # the snapshot, or None when it is missing, unreadable or outdated
+    try:
+        with open(path) as source:
+            snapshot = json.load(source)
+    except (OSError, ValueError) as error:
+        logger.warning('warm start skipped, %s: %s', path, error)
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        logger.warning('warm start skipped, %s: unknown format', path)
+        return None
+    return snapshot
+
+
+def warm_start(path, quiz_sampler):
+    """
+    Preloads the category map and quiz_sampler from the snapshot at
+    path, without touching the database. The next data_versions poll
+    checks them: anything written since the snapshot is dropped again.
+    Returns whether the snapshot was used.
+    """
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return False
+    if not expect_data_versions(snapshot['versions']):
+        logger.warning('warm start skipped, %s: older than this process',
+                       path)
+        return False
+
+    Category.preload({int(category): type_ for category, type_
+                      in snapshot['categories'].items()})
+    quiz_sampler.load(snapshot['questions'])
+    return True
@@ -0,0 +1,154 @@
+import atexit
+import queue
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from models import Question
+
+# open queues, closed at exit; held weakly so a dropped app is freed
+_queues = weakref.WeakSet()
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of validated question rows, written by a background
+    thread with Question.insert_many(): a batch is flushed once it holds
+    batch_size rows or interval seconds after its first row. A batch that
+    fails is retried row by row, so one bad row does not lose the others.
+
+    Every row gets a ticket whose status (queued, written with its id, or
+    failed with the error) stays available for the last max_size rows.
+    The worker exits once idle for interval seconds, and rows still
+    queued are written at interpreter exit.
+    """
+
+    def __init__(self, app, max_size, batch_size, interval):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_size = max_size
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'last_flush': None,
+            'last_error': None
+        }
+        self._queue = queue.Queue(max_size)
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        _queues.add(self)
+
+    def submit(self, row):
+        # the row's ticket, or None when the queue is full
+        ticket = uuid.uuid4().hex
+        with self._lock:
+            # known before the worker can report on it
+            self._tickets[ticket] = {'status': 'queued'}
+            while len(self._tickets) > self.max_size:
+                self._tickets.popitem(last=False)
+        try:
+            self._queue.put_nowait((ticket, row))
+        except queue.Full:
+            with self._lock:
+                self._tickets.pop(ticket, None)
+            return None
+
+        with self._lock:
+            self.stats['queued'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='trivia-write-behind')
+                self._thread.daemon = True
+                self._thread.start()
+        return ticket
+
+    def ticket(self, ticket):
+        with self._lock:
+            status = self._tickets.get(ticket)
+            return dict(status) if status is not None else None
+
+    def status(self):
+        with self._lock:
+            return dict(self.stats, pending=self._queue.qsize())
+
+    def flush(self):
+        # blocks until every row submitted so far is written or failed
+        self._queue.join()
+
+    def close(self):
+        _queues.discard(self)
+        self._stopping = True
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not (self._stopping and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                with self._lock:
+                    # idle: the next submit() starts a new worker
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(0.001, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                created = Question.insert_many([row for _, row in batch])
+                results = [(ticket, question['id'], None) for (ticket, _),
+                           question in zip(batch, created)]
+            except Exception:
+                # isolate the bad rows
+                results = []
+                for ticket, row in batch:
+                    try:
+                        question = Question.insert_many([row])[0]
+                        results.append((ticket, question['id'], None))
+                    except Exception as error:
+                        results.append((ticket, None, str(error)))
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['last_flush'] = time.time()
+            for ticket, question_id, error in results:
+                if error is None:
+                    self.stats['written'] += 1
+                    status = {'status': 'written', 'id': question_id}
+                else:
+                    self.stats['failed'] += 1
+                    self.stats['last_error'] = error
+                    status = {'status': 'failed', 'error': error}
+                if ticket in self._tickets:
+                    self._tickets[ticket] = status
+
+
+@atexit.register
+def _close_queues():
+    # rows still queued are written before the interpreter exits
+    for write_behind in list(_queues):
+        write_behind.close()
@@ -0,0 +1,13 @@
+-- Trigram indexes for /questions/search.
+-- ILIKE '%term%' on question/answer becomes a bitmap index scan and
+-- similarity() provides the relevance ordering.
+--
+--     psql trivia < migrations/001_question_search.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_trgm
+    ON public.questions USING gin (question gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm
+    ON public.questions USING gin (answer gin_trgm_ops);
@@ -0,0 +1,24 @@
+-- Counter cache of questions per category (category 0 = all questions),
+-- kept current by Question.insert/update/delete.
+--
+--     psql trivia < migrations/002_question_counts.sql
+
+CREATE TABLE IF NOT EXISTS public.question_counts (
+    category integer NOT NULL PRIMARY KEY,
+    total integer NOT NULL
+);
+
+BEGIN;
+
+DELETE FROM public.question_counts;
+
+INSERT INTO public.question_counts (category, total)
+SELECT 0, count(*) FROM public.questions;
+
+INSERT INTO public.question_counts (category, total)
+SELECT c.id, count(q.id)
+FROM public.categories c
+LEFT JOIN public.questions q ON q.category = c.id
+GROUP BY c.id;
+
+COMMIT;
@@ -0,0 +1,46 @@
+-- Make questions.category an indexed integer foreign key to categories.id.
+--
+-- trivia.psql already ships the column as integer with the constraint;
+-- databases created by db.create_all() before this change hold it as
+-- varchar. Both end up with the same schema, converted in place.
+--
+--     psql trivia < migrations/003_category_foreign_key.sql
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'questions'
+          AND column_name = 'category') <> 'integer' THEN
+        ALTER TABLE public.questions ALTER COLUMN category TYPE integer
+            USING CASE WHEN category ~ '^\s*\d+\s*$'
+                       THEN trim(category)::integer END;
+    END IF;
+END $$;
+
+-- the constraint can only be added once every value references a category
+UPDATE public.questions SET category = NULL
+WHERE category IS NOT NULL
+  AND category NOT IN (SELECT id FROM public.categories);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'public.questions'::regclass
+                     AND contype = 'f') THEN
+        ALTER TABLE public.questions
+            ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category)
+            REFERENCES public.categories(id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END $$;
+
+-- B-tree on (category, id): category filters and keyset/offset pages of
+-- one category ordered by id are both index scans
+CREATE INDEX IF NOT EXISTS ix_questions_category_id
+    ON public.questions (category, id);
+
+COMMIT;
+
+ANALYZE public.questions;
@@ -0,0 +1,23 @@
+-- Number of questions per (category, difficulty); 0 stands for a missing
+-- category or difficulty. Kept current by Question.insert/update/delete
+-- and served by GET /stats.
+--
+--     psql trivia < migrations/004_question_stats.sql
+
+CREATE TABLE IF NOT EXISTS public.question_stats (
+    category integer NOT NULL,
+    difficulty integer NOT NULL,
+    total integer NOT NULL,
+    PRIMARY KEY (category, difficulty)
+);
+
+BEGIN;
+
+DELETE FROM public.question_stats;
+
+INSERT INTO public.question_stats (category, difficulty, total)
+SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*)
+FROM public.questions
+GROUP BY 1, 2;
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- One version counter per logical dataset ('questions', 'categories',
+-- 'category:<id>'), bumped in the transaction of every write made through
+-- the models. Workers poll it to drop caches another worker made stale.
+--
+--     psql trivia < migrations/005_data_versions.sql
+
+CREATE TABLE IF NOT EXISTS public.data_versions (
+    name character varying NOT NULL PRIMARY KEY,
+    version integer NOT NULL
+);
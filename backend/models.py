@@ -1,44 +1,217 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, DDL, create_engine, event, func, inspect, literal, select
+from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from flask import current_app, g, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
-from settings import DB_NAME, DB_USER, DB_PASSWORD
+from querylog import slow_queries
+from settings import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DATABASE_URL, \
+    DATABASE_REPLICA_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, \
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT, \
+    CATEGORY_CACHE_TTL, DATA_VERSION_POLL_INTERVAL
 
 database_name = DB_NAME
-database_path = "postgresql://{}:{}@{}/{}".format(
-    DB_USER, DB_PASSWORD, "localhost:5432", database_name)
+database_path = DATABASE_URL or "postgresql://{}:{}@{}/{}".format(
+    DB_USER, DB_PASSWORD, DB_HOST, database_name)
+
+REPLICA_BIND = 'replica'
+
+
+"""
+RoutingSession
+    session that sends reads to the read replica while the current
+    request is marked with use_replica(); flushes, and everything outside
+    such requests, stay on the primary database
+"""
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and _replica_requested(self.app):
+            return db.get_engine(self.app, bind=REPLICA_BIND)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def use_replica(enabled=True):
+    # marks the current request as read-only, see RoutingSession
+    g.db_replica = enabled
+
+
+def _replica_requested(app):
+    return has_request_context() and g.get('db_replica', False) and \
+        REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+"""
+engine_options(database_path)
+    engine and pool settings from settings.py (or the environment) for
+    the given database URI; pool sizing is skipped for SQLite and the
+    statement timeout only applies to PostgreSQL
+"""
+
+
+def engine_options(database_path, pool_size=DB_POOL_SIZE,
+                   max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                   pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING,
+                   statement_timeout=DB_STATEMENT_TIMEOUT):
+    backend = make_url(database_path).get_backend_name()
+    options = {
+        'pool_pre_ping': pool_pre_ping,
+        'pool_recycle': pool_recycle
+    }
+    if backend != 'sqlite':
+        options.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout
+        )
+    if backend == 'postgresql' and statement_timeout:
+        options['connect_args'] = {
+            'options': '-c statement_timeout={:d}'.format(statement_timeout)
+        }
+    return options
 
-db = SQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. With a
+    replica_path, requests marked with use_replica() read from it.
+    Engines connect on first use; only create_schema makes it create
+    the missing tables right away
 """
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path,
+             replica_path=DATABASE_REPLICA_URL, options=None,
+             create_schema=False):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = \
+        {REPLICA_BIND: replica_path} if replica_path else {}
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = \
+        options if options is not None else engine_options(database_path)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config['JSON_SORT_KEYS'] = False
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+    # time every statement; slow ones go to the slow-query log. Listening
+    # on the Engine class also covers the replica and engines that
+    # Flask-SQLAlchemy creates later, when the URI changes
+    slow_queries.attach(Engine)
+
+    if create_schema:
+        db.create_all()
+
+
+"""
+on_question_change(listener, app=None)
+    registers listener(action, before, after), called after every
+    committed question write. action is 'insert', 'update' or 'delete'
+    with before/after holding the formatted question (or None), or
+    'reset' after bulk changes that in-process caches must rebuild from.
+    'stale' (before={'category': id}) reports that another worker changed
+    the questions of that category, see sync_data_versions().
+    Listeners given an app are kept in its extensions and only called for
+    writes made under that app, so they go away with it; the others are
+    process-wide.
+"""
+
+_question_listeners = []
+
+
+def on_question_change(listener, app=None):
+    if app is None:
+        _question_listeners.append(listener)
+    else:
+        app.extensions.setdefault('question_listeners', []).append(listener)
+    return listener
+
+
+def question_changed(action, before=None, after=None):
+    listeners = list(_question_listeners)
+    if has_app_context():
+        listeners += current_app.extensions.get('question_listeners', ())
+    for listener in listeners:
+        listener(action, before, after)
+
+
+"""
+data_version()
+    stamp of the data behind the GET endpoints, changed by every question
+    and category write made through the models. It starts from the boot
+    time so a restarted process never reuses an old stamp.
+data_modified()
+    unix time of the last write (or of the boot)
+"""
+
+_data_version = {
+    'boot': '{:x}'.format(int(time.time() * 1000)),
+    'counter': 0,
+    'modified': time.time(),
+    'lock': threading.Lock()
+}
+
+
+def data_version():
+    return '{}.{}'.format(_data_version['boot'], _data_version['counter'])
+
+
+def data_modified():
+    return _data_version['modified']
+
+
+def bump_data_version(*args):
+    with _data_version['lock']:
+        _data_version['counter'] += 1
+        _data_version['modified'] = time.time()
+
+
+on_question_change(bump_data_version)
 
 
 """
 Question
+    insert_many() / delete_many() write whole batches in one transaction
+    and notify the listeners once per question
 
 """
 
+QUESTION_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
 
 class Question(db.Model):
     __tablename__ = 'questions'
 
+    # active_history: setting a column of an expired instance loads the
+    # old value first, so update() still knows what it replaces
     id = Column(Integer, primary_key=True)
-    question = Column(String)
-    answer = Column(String)
-    category = Column(String)
-    difficulty = Column(Integer)
+    question = orm.column_property(Column(String), active_history=True)
+    answer = orm.column_property(Column(String), active_history=True)
+    category = orm.column_property(Column(Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL')),
+        active_history=True)
+    difficulty = orm.column_property(Column(Integer), active_history=True)
+
+    # serves category filters and paginated category listings
+    # (WHERE category = ? ORDER BY id) alike
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -48,14 +221,101 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_aggregates(question_deltas([self.format()]))
         db.session.commit()
+        question_changed('insert', after=self.format())
 
     def update(self):
+        before = self._previous_format()
+        after = self.format()
+        bump_aggregates(question_deltas(
+            [before], -1, question_deltas([after])))
         db.session.commit()
+        question_changed('update', before, after)
 
     def delete(self):
+        before = self.format()
         db.session.delete(self)
+        bump_aggregates(question_deltas([before], -1))
         db.session.commit()
+        question_changed('delete', before=before)
+
+    @classmethod
+    def insert_many(cls, rows):
+        """
+        Inserts validated question rows with one multi-row INSERT and
+        commits once; returns the formatted questions in input order.
+        """
+        if not rows:
+            return []
+        table = cls.__table__
+        try:
+            if db.session.connection(mapper=inspect(cls)).dialect.name \
+                    == 'postgresql':
+                # RETURNING yields the rows in VALUES order
+                created = [dict(row) for row in db.session.execute(
+                    table.insert().values(rows).returning(*table.c))]
+            else:
+                # no RETURNING in this dialect: flush ORM rows for the ids
+                questions = [cls(**row) for row in rows]
+                db.session.add_all(questions)
+                db.session.flush()
+                created = [question.format() for question in questions]
+
+            bump_aggregates(question_deltas(created))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        created = [{key: row[key] for key in QUESTION_COLUMNS}
+                   for row in created]
+        for row in created:
+            question_changed('insert', after=row)
+        return created
+
+    @classmethod
+    def delete_many(cls, ids):
+        """
+        Deletes the questions with the given ids with one
+        DELETE ... WHERE id IN and commits once; returns the formatted
+        questions that existed.
+        """
+        if not ids:
+            return []
+        try:
+            found = db.session.query(
+                *(getattr(cls, key) for key in QUESTION_COLUMNS)).filter(
+                    cls.id.in_(ids)).with_for_update().all()
+            deleted = [dict(zip(QUESTION_COLUMNS, row)) for row in found]
+            if deleted:
+                db.session.query(cls).filter(cls.id.in_(
+                    [row['id'] for row in deleted])).delete(
+                        synchronize_session=False)
+                bump_aggregates(question_deltas(deleted, -1))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        for row in deleted:
+            question_changed('delete', before=row)
+        return deleted
+
+    @classmethod
+    def total(cls, category=None):
+        # O(1) read of the counter cache, primed from COUNT(*) when missing
+        return QuestionCount.get(category)
+
+    def _previous_format(self):
+        # format() as last loaded from the database, before pending changes
+        previous = self.format()
+        state = inspect(self)
+        for key in previous:
+            history = state.attrs[key].history
+            if history.deleted:
+                previous[key] = history.deleted[0]
+        return previous
 
     def format(self):
         return {
@@ -67,8 +327,375 @@ class Question(db.Model):
         }
 
 
+"""
+QuestionCount
+    counter cache of questions per category. The row of category 0
+    (ALL_CATEGORIES) holds the total of all questions. Rows are seeded
+    with the table (create_all, migration 002, rebuild()) and for each new
+    category; question writes then add their deltas with a single-row
+    UPDATE in their own transaction. A row that is still missing is
+    seeded by the next write to it, and counted without being stored
+    when read.
+"""
+
+ALL_CATEGORIES = 0
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def get(cls, category=None):
+        key = int(category) if category else ALL_CATEGORIES
+        total = db.session.query(cls.total).filter_by(category=key).scalar()
+        if total is not None:
+            return total
+
+        # not seeded yet: counted, never written from a read
+        selection = db.session.query(func.count(Question.id))
+        if key != ALL_CATEGORIES:
+            selection = selection.filter(Question.category == key)
+        return selection.scalar()
+
+    @classmethod
+    def bump(cls, deltas):
+        # deltas maps category -> change in question count; runs inside the
+        # caller's transaction. Existing rows take a single-row UPDATE; a
+        # missing one is seeded from a count that already includes the
+        # caller's flushed changes
+        changes = {}
+        for category, delta in deltas.items():
+            changes[ALL_CATEGORIES] = changes.get(ALL_CATEGORIES, 0) + delta
+            if category:
+                key = int(category)
+                changes[key] = changes.get(key, 0) + delta
+
+        table = cls.__table__
+        for key, delta in sorted(changes.items()):
+            if not delta:
+                continue
+            updated = db.session.query(cls).filter_by(category=key).update(
+                {cls.total: cls.total + delta}, synchronize_session=False)
+            if updated:
+                continue
+
+            db.session.flush()
+            seed = cls._recount(key)
+            if db.session.connection(
+                    mapper=inspect(cls)).dialect.name == 'postgresql':
+                # another writer may seed the same row meanwhile
+                seed = seed.on_conflict_do_update(
+                    index_elements=[table.c.category],
+                    set_={'total': table.c.total + delta})
+            db.session.execute(seed)
+
+    @classmethod
+    def _recount(cls, key):
+        # INSERT ... SELECT of the current count of one row
+        selection = select([literal(key), func.count(Question.id)])
+        if key != ALL_CATEGORIES:
+            selection = selection.where(Question.category == key)
+        return postgresql.insert(cls.__table__).from_select(
+            ['category', 'total'], selection)
+
+    @classmethod
+    def recount(cls):
+        # INSERT ... SELECT of the per category rows
+        return cls.__table__.insert().from_select(
+            ['category', 'total'],
+            select([Category.id, func.count(Question.id)]).select_from(
+                Category.__table__.outerjoin(
+                    Question.__table__, Question.category == Category.id)
+            ).group_by(Category.id))
+
+    @classmethod
+    def rebuild(cls):
+        totals = {}
+        for category, total in db.session.query(
+                Question.category, func.count(Question.id)).group_by(
+                    Question.category):
+            key = int(category) if category else ALL_CATEGORIES
+            totals[key] = totals.get(key, 0) + total
+
+        rows = [{'category': ALL_CATEGORIES, 'total': sum(totals.values())}]
+        for (category,) in db.session.query(Category.id):
+            rows.append({'category': category,
+                         'total': totals.get(category, 0)})
+
+        db.session.query(cls).delete()
+        db.session.execute(cls.__table__.insert(), rows)
+        db.session.commit()
+        return rows[0]['total']
+
+
+"""
+QuestionStat
+    number of questions per (category, difficulty), category and
+    difficulty 0 standing for questions without one. Question writes
+    upsert the rows in their own transaction, so GET /stats reads a row
+    per pair instead of counting the questions; rebuild() recounts them.
+"""
+
+
+class QuestionStat(db.Model):
+    __tablename__ = 'question_stats'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    difficulty = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, deltas):
+        # deltas maps (category, difficulty) -> change in question count;
+        # keys are applied in order so concurrent writers never deadlock
+        table = cls.__table__
+        changes = {}
+        for (category, difficulty), delta in deltas.items():
+            key = (int(category or 0), int(difficulty or 0))
+            changes[key] = changes.get(key, 0) + delta
+
+        dialect = db.session.connection(mapper=inspect(cls)).dialect.name
+        for (category, difficulty), delta in sorted(changes.items()):
+            if not delta:
+                continue
+            if delta > 0 and dialect == 'postgresql':
+                upsert = postgresql.insert(table).values(
+                    category=category, difficulty=difficulty, total=delta)
+                db.session.execute(upsert.on_conflict_do_update(
+                    index_elements=[table.c.category, table.c.difficulty],
+                    set_={'total': table.c.total + upsert.excluded.total}))
+                continue
+
+            updated = db.session.query(cls).filter_by(
+                category=category, difficulty=difficulty).update(
+                    {cls.total: cls.total + delta}, synchronize_session=False)
+            if not updated and delta > 0:
+                db.session.execute(table.insert().values(
+                    category=category, difficulty=difficulty, total=delta))
+
+    @classmethod
+    def all(cls):
+        # (category, difficulty, total) rows, one per pair in use
+        return db.session.query(cls.category, cls.difficulty, cls.total).filter(
+            cls.total > 0).order_by(cls.category, cls.difficulty).all()
+
+    @classmethod
+    def recount(cls):
+        # INSERT ... SELECT of the current counts
+        category = func.coalesce(Question.category, 0)
+        difficulty = func.coalesce(Question.difficulty, 0)
+        return cls.__table__.insert().from_select(
+            ['category', 'difficulty', 'total'],
+            select([category, difficulty, func.count(Question.id)]).group_by(
+                category, difficulty))
+
+    @classmethod
+    def rebuild(cls):
+        db.session.query(cls).delete()
+        db.session.execute(cls.recount())
+        db.session.commit()
+        return db.session.query(func.coalesce(func.sum(cls.total), 0)).scalar()
+
+
+# freshly created question_stats and question_counts tables are filled
+# from the questions at once, so Question writes only ever need to
+# adjust them
+@event.listens_for(db.Model.metadata, 'after_create')
+def _fill_aggregates(metadata, connection, tables=(), **kw):
+    if QuestionStat.__table__ in tables:
+        connection.execute(QuestionStat.recount())
+    if QuestionCount.__table__ in tables:
+        connection.execute(QuestionCount._recount(ALL_CATEGORIES))
+        connection.execute(QuestionCount.recount())
+
+
+def question_deltas(questions, sign=1, deltas=None):
+    # {(category, difficulty): change} for formatted questions
+    deltas = {} if deltas is None else deltas
+    for question in questions:
+        key = (question['category'], question['difficulty'])
+        deltas[key] = deltas.get(key, 0) + sign
+    return deltas
+
+
+def bump_aggregates(deltas):
+    # counter cache and statistics, inside the caller's transaction
+    counts = {}
+    for (category, _), delta in deltas.items():
+        counts[category] = counts.get(category, 0) + delta
+    QuestionCount.bump(counts)
+    QuestionStat.bump(deltas)
+    if deltas:
+        DataVersion.bump([QUESTIONS_VERSION] + [
+            category_version(category) for category in counts])
+
+
+"""
+DataVersion
+    one version counter per logical dataset: QUESTIONS_VERSION,
+    CATEGORIES_VERSION and category_version(id) for the questions of
+    each category. Writes bump their rows in their own transaction, and
+    sync_data_versions() compares them with the versions a worker last
+    saw, so in-process caches stay coherent across worker processes.
+"""
+
+QUESTIONS_VERSION = 'questions'
+CATEGORIES_VERSION = 'categories'
+
+
+def category_version(category):
+    return 'category:{}'.format(int(category or 0))
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, names):
+        # runs inside the caller's transaction, rows in name order so
+        # concurrent writers never deadlock; the new versions are noted on
+        # the session and count as seen once it commits
+        table = cls.__table__
+        dialect = db.session.connection(mapper=inspect(cls)).dialect.name
+        written = {}
+        for name in sorted(set(names)):
+            if dialect == 'postgresql':
+                upsert = postgresql.insert(table).values(name=name, version=1)
+                written[name] = db.session.execute(upsert.on_conflict_do_update(
+                    index_elements=[table.c.name],
+                    set_={'version': table.c.version + 1}).returning(
+                        table.c.version)).scalar()
+                continue
+
+            updated = db.session.query(cls).filter_by(name=name).update(
+                {cls.version: cls.version + 1}, synchronize_session=False)
+            if not updated:
+                db.session.execute(table.insert().values(name=name, version=1))
+            written[name] = db.session.query(cls.version).filter_by(
+                name=name).scalar()
+        db.session.info.setdefault('data_versions', {}).update(written)
+
+    @classmethod
+    def current(cls):
+        # {name: version}, read on a connection of its own so the request's
+        # session (and the replica routing) is left alone
+        with db.engine.connect() as connection:
+            return dict(connection.execute(
+                select([cls.name, cls.version])).fetchall())
+
+
+_synced_versions = {
+    'versions': None,
+    'checked': None,
+    'lock': threading.Lock(),
+    'polling': threading.Lock()
+}
+
+
+def expect_data_versions(versions):
+    """
+    Makes versions, those of a warm-start snapshot, the ones the next
+    sync_data_versions() compares with, so it drops whatever the snapshot
+    preloaded that changed since. False when this process has already
+    seen other versions, and the snapshot can not be checked.
+    """
+    with _synced_versions['lock']:
+        if _synced_versions['versions'] is None:
+            _synced_versions['versions'] = dict(versions)
+            return True
+        return _synced_versions['versions'] == versions
+
+
+def sync_data_versions(interval=DATA_VERSION_POLL_INTERVAL):
+    """
+    Reads data_versions, at most once per interval seconds (never when
+    negative), and drops what changed since the last read: the category
+    map and the data version on a category write, and 'stale' (or
+    'reset') question listeners on a question write. Versions this
+    process committed itself are already seen and cost nothing.
+    """
+    state = _synced_versions
+    checked = state['checked']
+    if interval < 0 or (checked is not None and
+                        time.monotonic() - checked < interval):
+        return []
+    # one request per worker polls; the others go on with their caches
+    if not state['polling'].acquire(blocking=False):
+        return []
+    try:
+        state['checked'] = time.monotonic()
+        versions = DataVersion.current()
+        with state['lock']:
+            seen, state['versions'] = state['versions'], versions
+    finally:
+        state['polling'].release()
+    if seen is None:
+        return []
+
+    changed = sorted(name for name, version in versions.items()
+                     if seen.get(name) != version)
+    if CATEGORIES_VERSION in changed:
+        Category.invalidate_cache()
+        bump_data_version()
+    categories = [int(name.split(':', 1)[1]) for name in changed
+                  if name.startswith('category:')]
+    for category in categories:
+        question_changed('stale', before={'category': category or None})
+    if QUESTIONS_VERSION in changed and not categories:
+        question_changed('reset')
+    return changed
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _versions_committed(session):
+    # a version this process wrote right after the one it had seen needs
+    # no invalidation; a larger jump means another worker wrote as well
+    written = session.info.pop('data_versions', None)
+    if not written:
+        return
+    with _synced_versions['lock']:
+        seen = _synced_versions['versions']
+        if seen is None:
+            return
+        for name, version in written.items():
+            if seen.get(name, 0) == version - 1:
+                seen[name] = version
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _versions_rolled_back(session):
+    session.info.pop('data_versions', None)
+
+
+# trigram indexes behind /questions/search on PostgreSQL; databases
+# restored from trivia.psql get them from migrations/001_question_search.sql.
+# Servers built without the contrib modules skip them and search unranked
+def _trigram_available(ddl, target, bind, **kw):
+    return bind.dialect.name == 'postgresql' and bind.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    ).scalar() is not None
+
+
+event.listen(Question.__table__, 'after_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm;'
+    'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+    'ON questions USING gin (question gin_trgm_ops);'
+    'CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm '
+    'ON questions USING gin (answer gin_trgm_ops)'
+).execute_if(callable_=_trigram_available))
+
+
 """
 Category
+    Category.as_map() serves the {id: type} map from a process-level
+    cache. Category writes invalidate it; CATEGORY_CACHE_TTL (seconds,
+    0 = never) bounds how long changes made outside the app stay hidden
 
 """
 
@@ -82,8 +709,81 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.flush()
+        # a new category starts with a seeded, empty counter row
+        db.session.add(QuestionCount(category=self.id, total=0))
+        DataVersion.bump([CATEGORIES_VERSION])
+        db.session.commit()
+        Category.invalidate_cache()
+        bump_data_version()
+
+    def update(self):
+        DataVersion.bump([CATEGORIES_VERSION])
+        db.session.commit()
+        Category.invalidate_cache()
+        bump_data_version()
+
+    def delete(self):
+        db.session.delete(self)
+        # its questions lose their category (ON DELETE SET NULL)
+        DataVersion.bump([CATEGORIES_VERSION, QUESTIONS_VERSION,
+                          category_version(self.id)])
+        db.session.commit()
+        Category.invalidate_cache()
+        bump_data_version()
+
+    @classmethod
+    def as_map(cls):
+        # {id: type} of every category, served from the process-level cache
+        with _category_cache['lock']:
+            now = time.monotonic()
+            expires = _category_cache['expires']
+            if _category_cache['map'] is not None and (
+                    expires is None or now < expires):
+                _category_cache['hits'] += 1
+                return dict(_category_cache['map'])
+
+            _category_cache['misses'] += 1
+            categories = db.session.query(cls.id, cls.type).order_by(cls.id)
+            _category_cache['map'] = {cat.id: cat.type for cat in categories}
+            _category_cache['expires'] = now + CATEGORY_CACHE_TTL \
+                if CATEGORY_CACHE_TTL else None
+            return dict(_category_cache['map'])
+
+    @classmethod
+    def preload(cls, categories):
+        # fills the process-level cache with a known {id: type} map
+        with _category_cache['lock']:
+            _category_cache['map'] = dict(categories)
+            _category_cache['expires'] = time.monotonic() + \
+                CATEGORY_CACHE_TTL if CATEGORY_CACHE_TTL else None
+
+    @classmethod
+    def invalidate_cache(cls):
+        with _category_cache['lock']:
+            _category_cache['map'] = None
+            _category_cache['expires'] = None
+            _category_cache['invalidations'] += 1
+
+    @classmethod
+    def cache_stats(cls):
+        return {key: _category_cache[key]
+                for key in ('hits', 'misses', 'invalidations')}
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+_category_cache = {
+    'map': None,
+    'expires': None,
+    'hits': 0,
+    'misses': 0,
+    'invalidations': 0,
+    'lock': threading.Lock()
+}
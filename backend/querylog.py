@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import random
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from settings import SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_KEEP, \
+    SLOW_QUERY_LOG, SLOW_QUERY_LOG_BYTES, SLOW_QUERY_LOG_BACKUPS
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# frames from these are skipped when looking for the call site
+LIBRARY_PATHS = (os.sep + 'site-packages' + os.sep,
+                 os.sep + 'sqlalchemy' + os.sep,
+                 os.sep + 'flask_sqlalchemy' + os.sep,
+                 os.path.abspath(__file__))
+
+PARAMETERS_LIMIT = 500
+
+
+"""
+SlowQueryLog
+    times every statement of the engines attached to it (setup_db
+    attaches the Engine class, so every engine) and keeps the ones slower than
+    threshold_ms with their route, bound parameters and call site. On
+    PostgreSQL a share explain_rate of the slow SELECTs is run again under
+    EXPLAIN (ANALYZE, BUFFERS), inside a savepoint. The last `keep` are
+    held in memory for /debug/slow-queries; with log_path every record is
+    also written as a JSON line to a rotating log file.
+"""
+
+
+class SlowQueryLog:
+
+    def __init__(self, threshold_ms, explain_rate, keep, log_path=None,
+                 log_bytes=10 * 1024 * 1024, log_backups=5):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self._records = deque(maxlen=keep)
+        self.logger = logging.getLogger('trivia.slow_queries')
+        self.logger.propagate = False
+        if log_path and not self.logger.handlers:
+            self.logger.setLevel(logging.INFO)
+            self.logger.addHandler(RotatingFileHandler(
+                log_path, maxBytes=log_bytes, backupCount=log_backups))
+
+    def attach(self, engine):
+        # idempotent: setup_db may run more than once
+        if event.contains(engine, 'before_cursor_execute', self._before):
+            return
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def records(self):
+        # newest first
+        return list(reversed(self._records))
+
+    def clear(self):
+        self._records.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        conn.info['slow_query_start'] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        started = conn.info.pop('slow_query_start', None)
+        if started is None or self.threshold_ms < 0:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        record = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(duration_ms, 3),
+            'statement': statement,
+            'parameters': repr(parameters)[:PARAMETERS_LIMIT],
+            'route': None,
+            'call_site': call_site()
+        }
+        if has_request_context():
+            rule = request.url_rule
+            record['route'] = '{} {}'.format(
+                request.method,
+                rule.rule if rule is not None else request.path)
+
+        if conn.dialect.name == 'postgresql' and not executemany and \
+                statement.lstrip()[:6].upper() == 'SELECT' and \
+                random.random() < self.explain_rate:
+            record['plan'] = explain(conn, statement, parameters)
+
+        self._records.append(record)
+        if self.logger.handlers:
+            self.logger.info(json.dumps(record, default=str))
+
+
+def explain(conn, statement, parameters):
+    # EXPLAIN (ANALYZE, BUFFERS) on the raw DBAPI cursor, so it neither
+    # fires cursor events nor breaks the transaction when it fails
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement,
+                           parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        except Exception as error:
+            cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return ['EXPLAIN failed: {}'.format(error)]
+    except Exception as error:
+        return ['EXPLAIN failed: {}'.format(error)]
+    finally:
+        cursor.close()
+
+
+def call_site():
+    # innermost application frame that issued the statement
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if not frame.filename.startswith(BACKEND_DIR) or \
+                any(path in frame.filename for path in LIBRARY_PATHS):
+            continue
+        return '{}:{} in {}'.format(
+            os.path.relpath(frame.filename, BACKEND_DIR), frame.lineno,
+            frame.name)
+    return None
+
+
+slow_queries = SlowQueryLog(
+    SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_KEEP, SLOW_QUERY_LOG,
+    SLOW_QUERY_LOG_BYTES, SLOW_QUERY_LOG_BACKUPS)
@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 
+import json
 import os
 
 load_dotenv()
@@ -7,3 +8,134 @@ DB_NAME = os.environ.get('DB_NAME')
 TEST_DB_NAME = os.environ.get('TEST_DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
+
+# database location: DATABASE_URL, when set, replaces the DB_* settings
+DB_HOST = os.environ.get('DB_HOST', 'localhost:5432')
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# optional read replica: GET endpoints and /questions/search read from it,
+# except for REPLICA_LAG_WINDOW seconds after a write this worker made or
+# saw, so a lagging replica cannot be cached under the new data version
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_LAG_WINDOW = float(os.environ.get('REPLICA_LAG_WINDOW', 2))
+
+# create missing tables when the app starts; off by default so a worker
+# boots without touching the database (see `flask create-schema`)
+CREATE_SCHEMA = os.environ.get('CREATE_SCHEMA', 'false').lower() in (
+    '1', 'true', 'yes')
+
+# warm start: JSON file written by `flask write-snapshot`, preloaded into
+# the category map and the quiz sampler when a worker starts
+WARM_START_SNAPSHOT = os.environ.get('WARM_START_SNAPSHOT')
+
+# engine and connection pool (pool sizes do not apply to SQLite);
+# DB_POOL_RECYCLE is in seconds (-1 = never), DB_STATEMENT_TIMEOUT in
+# milliseconds (0 = none, PostgreSQL only)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', -1))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in (
+    '1', 'true', 'yes')
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+# worker threads of the ASGI mode (flaskr/asgi.py); by default one per
+# pooled connection, so no request thread waits on the pool
+ASGI_THREADS = int(os.environ.get(
+    'ASGI_THREADS', DB_POOL_SIZE + DB_MAX_OVERFLOW))
+
+# quiz sessions: idle seconds before a deck expires, and how many decks
+# a worker keeps before evicting the least recently used one
+QUIZ_SESSION_TTL = int(os.environ.get('QUIZ_SESSION_TTL', 1800))
+QUIZ_SESSION_LIMIT = int(os.environ.get('QUIZ_SESSION_LIMIT', 10000))
+
+# seconds the category map stays cached; 0 keeps it until a category write
+CATEGORY_CACHE_TTL = float(os.environ.get('CATEGORY_CACHE_TTL', 0))
+
+# seconds between two reads of the data_versions table, through which a
+# worker learns about writes made by the other workers and drops its stale
+# caches; 0 reads it on every request, -1 never (single-process servers)
+DATA_VERSION_POLL_INTERVAL = float(
+    os.environ.get('DATA_VERSION_POLL_INTERVAL', 1))
+
+# Cache-Control per GET endpoint as JSON, for example
+# CACHE_CONTROL='{"getall_categories": "public, max-age=300"}'.
+# Endpoints not listed send "no-cache": clients revalidate with ETags.
+CACHE_CONTROL = json.loads(os.environ.get('CACHE_CONTROL') or '{}')
+
+# request metrics served at /metrics; METRICS_SERVER_TIMING also adds a
+# Server-Timing header (database time, query count) to every response
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in (
+    '1', 'true', 'yes')
+METRICS_SERVER_TIMING = os.environ.get(
+    'METRICS_SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+
+# response compression (gzip, brotli when installed) of bodies of at least
+# COMPRESSION_MIN_SIZE bytes; COMPRESSION_CACHE_SIZE compressed GET bodies
+# are kept per worker (0 = no cache)
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() \
+    in ('1', 'true', 'yes')
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+COMPRESSION_CACHE_SIZE = int(os.environ.get('COMPRESSION_CACHE_SIZE', 128))
+
+# admission control, per worker. RATE_LIMITS maps endpoint names to
+# [tokens per second, burst] per client; CONCURRENCY_LIMITS maps endpoint
+# names to the requests allowed to run at once, each waiting at most
+# ADMISSION_QUEUE_TIMEOUT seconds for a slot. Both are JSON.
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() in (
+    '1', 'true', 'yes')
+RATE_LIMITS = json.loads(os.environ.get('RATE_LIMITS') or json.dumps({
+    'find_questions': [10, 20],
+    'batch_read': [10, 20],
+    'start_quiz': [10, 20],
+    'next_quiz_question': [20, 40]
+}))
+for _endpoint, (_rate, _burst) in RATE_LIMITS.items():
+    if _rate <= 0 or _burst < 1:
+        raise ValueError('RATE_LIMITS[{!r}] needs a rate above 0 and a burst '
+                         'of at least 1'.format(_endpoint))
+CONCURRENCY_LIMITS = json.loads(os.environ.get('CONCURRENCY_LIMITS') or
+                                json.dumps({
+                                    'find_questions': 8,
+                                    'batch_read': 8,
+                                    'start_quiz': 8,
+                                    'export_questions': 2,
+                                    'import_questions_file': 1
+                                }))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.1))
+
+# write-behind for POST /questions: rows are queued (at most
+# WRITE_BEHIND_QUEUE_SIZE) and inserted in batches of up to
+# WRITE_BEHIND_BATCH_SIZE, at the latest WRITE_BEHIND_INTERVAL seconds
+# after the first queued row
+WRITE_BEHIND_ENABLED = os.environ.get(
+    'WRITE_BEHIND_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 10000))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 500))
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+if WRITE_BEHIND_INTERVAL <= 0:
+    raise ValueError('WRITE_BEHIND_INTERVAL must be greater than 0')
+
+# search pages and category listings cached per worker: at most
+# RESULT_CACHE_SIZE entries, each for RESULT_CACHE_TTL seconds (0 = until
+# a question write drops it); a size of 0 disables the cache
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 60))
+
+# slow-query log: statements of at least SLOW_QUERY_MS milliseconds (-1 =
+# off) are kept (the last SLOW_QUERY_KEEP) for /debug/slow-queries and
+# appended to SLOW_QUERY_LOG when set, a file rotated at
+# SLOW_QUERY_LOG_BYTES. SLOW_QUERY_EXPLAIN_RATE of the slow SELECTs also
+# get an EXPLAIN (ANALYZE, BUFFERS) plan on PostgreSQL.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+SLOW_QUERY_KEEP = int(os.environ.get('SLOW_QUERY_KEEP', 100))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+SLOW_QUERY_LOG_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 10485760))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
+
+# /debug/slow-queries shows SQL text and bound parameters, so it is off
+# unless DEBUG_ENDPOINTS is set (and then still answers local clients only)
+DEBUG_ENDPOINTS = os.environ.get('DEBUG_ENDPOINTS', 'false').lower() in (
+    '1', 'true', 'yes')
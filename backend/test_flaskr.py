@@ -1,32 +1,50 @@
+import asyncio
+import gc
+import gzip
 import os
+import tempfile
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import weakref
+from unittest import mock
+from sqlalchemy import event
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.admission import init_admission
+from flaskr.quiz import QuizSampler
+from flaskr.search import TrigramIndex
+from querylog import slow_queries
+import models
+from models import setup_db, db, Question, Category, QuestionCount, \
+    QuestionStat, on_question_change, sync_data_versions
 from settings import TEST_DB_NAME, DB_USER, DB_PASSWORD
 
+try:
+    from flaskr.asgi import AsgiAdapter
+except ImportError:  # the ASGI mode is optional
+    AsgiAdapter = None
+
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    database_path = "postgresql://{}:{}@{}/{}".format(
+        DB_USER, DB_PASSWORD, 'localhost:5432', TEST_DB_NAME)
+
+    @classmethod
+    def setUpClass(cls):
+        # create the missing tables once, not for every test
+        create_app({'DATABASE_URL': cls.database_path, 'CREATE_SCHEMA': True})
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app({'DATABASE_URL': self.database_path})
         self.client = self.app.test_client
         self.database_name = TEST_DB_NAME
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            DB_USER, DB_PASSWORD, 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
             self.new_question = {
                 "question": "Me",
                 "answer": "You",
@@ -82,6 +100,216 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Page not found')
 
+    # testing keyset pagination with after_id cursor
+    def test_keyset_paginate_questions(self):
+        resp = self.client().get('/questions')
+        first_page = json.loads(resp.data)
+
+        resp = self.client().get(
+            '/questions?after_id={}'.format(first_page['next_cursor']))
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(
+            question['id'] > first_page['next_cursor']
+            for question in data['questions']))
+
+    # testing the total count can be left out
+    def test_paginate_questions_without_total(self):
+        resp = self.client().get('/questions?include_total=0')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('total_questions', data)
+        self.assertTrue(len(data['questions']))
+
+    # testing conditional GET answers 304 until the data changes
+    def test_conditional_get(self):
+        resp = self.client().get('/categories')
+        etag = resp.headers['ETag']
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers['Last-Modified'])
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+
+        resp = self.client().get('/categories',
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        self.client().post('/questions', json=self.new_question)
+        resp = self.client().get('/categories',
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    # testing gzip responses and the precompressed response cache
+    def test_compressed_responses(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        resp = self.client().get('/questions', headers=headers)
+        etag = resp.headers['ETag']
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertTrue(etag.endswith('-gzip"'))
+        self.assertTrue(json.loads(gzip.decompress(resp.data))['success'])
+
+        again = self.client().get('/questions', headers=headers)
+        self.assertEqual(again.data, resp.data)
+        self.assertEqual(again.headers['ETag'], etag)
+        metrics = self.client().get('/metrics').data.decode()
+        self.assertIn('trivia_compression_cache_hits 1', metrics)
+
+        resp = self.client().get('/questions', headers=dict(
+            headers, **{'If-None-Match': etag}))
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        resp = self.client().get('/questions')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertTrue(json.loads(resp.data)['success'])
+
+    # testing per-client rate limits answer 429 with Retry-After
+    def test_429handler_rate_limit(self):
+        admission = init_admission(
+            self.app, {'getall_categories': (0.1, 2)}, {})
+        for _ in range(2):
+            self.assertEqual(
+                self.client().get('/categories').status_code, 200)
+
+        resp = self.client().get('/categories')
+        data = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(int(resp.headers['Retry-After']) >= 1)
+        self.assertEqual(
+            admission.rejected[('getall_categories', 'rate_limited')], 1)
+
+    # testing a rate limit without tokens to refill is refused up front
+    def test_rate_limit_needs_positive_rate(self):
+        for limit in ((0, 20), (-1, 20), (10, 0.5)):
+            with self.assertRaises(ValueError):
+                init_admission(self.app, {'getall_categories': limit}, {})
+
+    # testing /batch operations are charged to their endpoints' limits
+    def test_429handler_batch_rate_limit(self):
+        admission = self.app.extensions['admission']
+        admission.rate_limits['find_questions'] = (0.1, 2)
+        resp = self.client().post('/batch', json={'operations': [
+            {'op': 'search', 'searchTerm': 'title'}] * 3 + [
+            {'op': 'categories'}]})
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([result['status'] for result in data['results']],
+                         [200, 200, 429, 200])
+        self.assertEqual(data['results'][2]['body']['message'],
+                         'Too many requests')
+        self.assertEqual(self.client().post(
+            '/questions/search', json=self.search_term).status_code, 429)
+        self.assertEqual(
+            admission.rejected[('find_questions', 'rate_limited')], 2)
+
+    # testing requests beyond the concurrency cap are shed with 503
+    def test_503handler_concurrency_limit(self):
+        admission = init_admission(
+            self.app, {}, {'getall_categories': 1}, queue_timeout=0)
+        admission.concurrency['getall_categories'].acquire()
+
+        resp = self.client().get('/categories')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
+
+        admission.concurrency['getall_categories'].release()
+        self.assertEqual(self.client().get('/categories').status_code, 200)
+        self.assertEqual(admission.in_flight['getall_categories'], 0)
+
+    # testing the slow-query log records route, call site and plan
+    def test_slow_query_log(self):
+        threshold, rate = slow_queries.threshold_ms, slow_queries.explain_rate
+        slow_queries.threshold_ms, slow_queries.explain_rate = 0, 1
+        slow_queries.clear()
+        try:
+            resp = self.client().post('/quizzes', json={
+                'previous_questions': [5, 9],
+                'quiz_category': {'type': 'Science', 'id': 1}
+            })
+            question_id = json.loads(resp.data)['question']['id']
+        finally:
+            slow_queries.threshold_ms, slow_queries.explain_rate = \
+                threshold, rate
+
+        # off unless DEBUG_ENDPOINTS is set
+        resp = self.client().get('/debug/slow-queries')
+        self.assertEqual(resp.status_code, 404)
+
+        self.app.config['DEBUG_ENDPOINTS'] = True
+        resp = self.client().get('/debug/slow-queries')
+        data = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 200)
+        query = [query for query in data['queries']
+                 if query['route'] == 'POST /quizzes' and
+                 query['call_site'].endswith(' in draw')][0]
+        self.assertTrue(query['call_site'].startswith('flaskr/quiz.py:'))
+        self.assertIn(str(question_id), query['parameters'])
+        self.assertTrue(any('actual time' in line for line in query['plan']))
+
+        # local clients only
+        resp = self.client().get('/debug/slow-queries',
+                                 environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(resp.status_code, 404)
+
+    # testing reads are routed to the replica and writes to the primary
+    # (the data_versions poll always reads the primary, so it is off here)
+    @mock.patch('flaskr.DATA_VERSION_POLL_INTERVAL', -1)
+    @mock.patch('flaskr.REPLICA_LAG_WINDOW', 0)
+    def test_read_replica_routing(self):
+        setup_db(self.app, self.database_path, replica_path=self.database_path)
+        statements = {'primary': 0, 'replica': 0}
+
+        with self.app.app_context():
+            for name, bind in (('primary', None), ('replica', 'replica')):
+                engine = db.get_engine(self.app, bind=bind)
+
+                def count(*args, name=name):
+                    statements[name] += 1
+                event.listen(engine, 'before_cursor_execute', count)
+
+        self.client().get('/questions')
+        self.client().post('/questions/search', json=self.search_term)
+        self.assertEqual(statements['primary'], 0)
+        self.assertTrue(statements['replica'])
+
+        replica_reads = statements['replica']
+        self.client().post('/questions', json=self.new_question)
+        self.assertTrue(statements['primary'])
+        self.assertEqual(statements['replica'], replica_reads)
+
+        # reads right after a write stay on the primary
+        primary_writes = statements['primary']
+        with mock.patch('flaskr.REPLICA_LAG_WINDOW', 60):
+            self.client().get('/questions?page=2')
+        self.assertTrue(statements['primary'] > primary_writes)
+        self.assertEqual(statements['replica'], replica_reads)
+
+    # testing request metrics are exposed in Prometheus format
+    def test_metrics(self):
+        self.client().get('/questions')
+        resp = self.client().get('/metrics')
+        text = resp.data.decode('utf-8')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('trivia_requests_total{route="/questions",method="GET",'
+                      'status="200"} 1', text)
+        self.assertIn('trivia_request_sql_statements_count'
+                      '{route="/questions",method="GET"} 1', text)
+        self.assertIn('trivia_category_cache_hits_total', text)
+        self.assertNotIn('ETag', resp.headers)
+
     # testing display all categories available
     def test_getAll_categories(self):
         resp = self.client().get('/categories')
@@ -92,6 +320,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_categories'])
         self.assertTrue(len(data['categories']))
 
+    # testing the category map is served from the cache
+    def test_category_cache(self):
+        with self.app.app_context():
+            Category.invalidate_cache()
+            stats = Category.cache_stats()
+
+            self.client().get('/categories')
+            self.client().get('/questions')
+            self.client().get('/categories')
+
+            after = Category.cache_stats()
+            self.assertEqual(after['misses'], stats['misses'] + 1)
+            self.assertEqual(after['hits'], stats['hits'] + 2)
+            self.assertEqual(Category.as_map()[1], 'Science')
+
+    # testing category filters are served by the (category, id) index
+    def test_category_queries_use_index(self):
+        with self.app.app_context():
+            hot_queries = [
+                Question.query.filter_by(category=2).order_by(
+                    Question.id).limit(11),
+                Question.query.filter(Question.category == 2,
+                                      Question.id.notin_([16, 17]))
+            ]
+            # the fixture tables are tiny; forbid sequential scans to see
+            # whether an index scan is possible at all
+            Question.query.session.execute('SET enable_seqscan = off')
+            for query in hot_queries:
+                sql = str(query.statement.compile(
+                    dialect=query.session.bind.dialect,
+                    compile_kwargs={'literal_binds': True}))
+                plan = '\n'.join(row[0] for row in query.session.execute(
+                    'EXPLAIN ' + sql))
+                self.assertIn('ix_questions_category_id', plan)
+            Question.query.session.rollback()
+
     # testing error for no available category
     def test_404handler_category_not_found(self):
         resp = self.client().get('/categories/8000/questions')
@@ -103,7 +367,9 @@ class TriviaTestCase(unittest.TestCase):
 
     # testing success remove question
     def test_remove_question(self):
-        question_no = 27
+        # delete a question of its own, so the suite can run repeatedly
+        resp = self.client().post('/questions', json=self.new_question)
+        question_no = json.loads(resp.data)['created_question']['id']
         resp = self.client().delete('/questions/{}'.format(question_no))
         data = json.loads(resp.data)
 
@@ -116,6 +382,78 @@ class TriviaTestCase(unittest.TestCase):
         # here the remaining question is from trivia db
         self.assertTrue(data['remaining_questions'])
 
+    # testing write-behind inserts, their tickets and ?sync=1
+    def test_write_behind_questions(self):
+        with mock.patch('flaskr.WRITE_BEHIND_ENABLED', True), \
+                mock.patch('flaskr.WRITE_BEHIND_INTERVAL', 0.05):
+            app = create_app({'DATABASE_URL': self.database_path})
+        client = app.test_client()
+
+        resp = client.post('/questions', json=self.new_question)
+        data = json.loads(resp.data)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(data['queued'], True)
+
+        # a synchronous insert lands after the rows queued before it
+        resp = client.post('/questions?sync=1', json=self.new_question)
+        created = json.loads(resp.data)['created_question']
+
+        resp = client.get('/questions/write-behind/' + data['ticket'])
+        status = json.loads(resp.data)
+        self.assertEqual(status['status'], 'written')
+        self.assertLess(status['id'], created['id'])
+
+        status = json.loads(client.get('/questions/write-behind').data)
+        self.assertEqual(status['written'], 1)
+        self.assertEqual(status['pending'], 0)
+        self.assertEqual(status['last_error'], None)
+
+        # the idle worker exits and the exit hook holds the queue weakly,
+        # so a dropped app is freed once db is bound to another one
+        app_ref = weakref.ref(app)
+        del app, client
+        create_app({'DATABASE_URL': self.database_path})
+        for _ in range(100):
+            gc.collect()
+            if app_ref() is None:
+                break
+            time.sleep(0.02)
+        self.assertIsNone(app_ref())
+
+    # testing batch create and batch delete with results per item
+    def test_batch_create_and_delete(self):
+        total = json.loads(self.client().get('/questions').data)[
+            'total_questions']
+        resp = self.client().post('/questions/batch', json=[
+            self.new_question, self.new_question2, self.new_question])
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(data['total_questions'], total + 2)
+        self.assertEqual([result['success'] for result in data['results']],
+                         [True, False, True])
+        ids = [result['id'] for result in data['results'] if 'id' in result]
+
+        resp = self.client().delete(
+            '/questions', json={'ids': ids + [ids[0], 100000, 'x']})
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['deleted'], 2)
+        self.assertEqual(data['remaining_questions'], total)
+        self.assertEqual([result.get('error') for result in data['results']],
+                         [None, None, 'duplicate id', 'not found',
+                          'invalid id'])
+
+    # testing error for a batch delete without ids
+    def test_422handler_batch_delete(self):
+        resp = self.client().delete('/questions', json={'ids': []})
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     # testing error for question not found
     def test_422handler_question_notFound(self):
         qts_no = 1000
@@ -137,6 +475,310 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['created_question']))
         self.assertTrue(data['total_questions'])
 
+    # testing app caches listen to writes of their own app only
+    def test_question_listeners_per_app(self):
+        listeners = list(models._question_listeners)
+        other = create_app({'DATABASE_URL': self.database_path})
+        self.assertEqual(models._question_listeners, listeners)
+
+        seen = []
+        on_question_change(lambda *change: seen.append(change), other)
+        resp = self.client().post('/questions', json=self.new_question)
+        question_id = json.loads(resp.data)['created_question']['id']
+        self.assertEqual(seen, [])
+
+        with other.test_client() as client:
+            client.delete('/questions/{}'.format(question_id))
+        self.assertEqual([action for action, _, _ in seen], ['delete'])
+
+    # testing the counter cache follows inserts and deletes
+    def test_question_counts_follow_writes(self):
+        with self.app.app_context():
+            before = Question.total(2)
+            self.assertEqual(before, Question.query.filter(
+                Question.category == 2).count())
+
+            resp = self.client().post('/questions', json=self.new_question)
+            data = json.loads(resp.data)
+            self.assertEqual(data['total_questions'], Question.query.count())
+            self.assertEqual(Question.total(2), before + 1)
+
+            resp = self.client().delete(
+                '/questions/{}'.format(data['created_question']['id']))
+            data = json.loads(resp.data)
+            self.assertEqual(data['remaining_questions'],
+                             Question.query.count())
+            self.assertEqual(Question.total(2), before)
+
+            self.assertEqual(QuestionCount.rebuild(), Question.query.count())
+            self.assertEqual(Question.total(2), before)
+
+    # testing counter rows are seeded once and then only updated
+    def test_question_counts_seeding(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement.lower())
+
+        with self.app.app_context():
+            category = Category('Counted')
+            category.insert()
+            ids = []
+            try:
+                # a new category starts with an empty row; writes update it
+                # without counting the questions again
+                event.listen(db.engine, 'before_cursor_execute', record)
+                try:
+                    for number in (1, 2):
+                        question = Question('Seeded?', 'Yes', category.id, 1)
+                        question.insert()
+                        ids.append(question.id)
+                        self.assertEqual(Question.total(category.id), number)
+                finally:
+                    event.remove(db.engine, 'before_cursor_execute', record)
+                self.assertFalse([statement for statement in statements
+                                  if 'count(' in statement])
+
+                # a missing row is counted on read without being stored,
+                # and seeded by the next write
+                QuestionCount.query.filter_by(category=category.id).delete()
+                db.session.commit()
+                self.assertEqual(Question.total(category.id), 2)
+                self.assertIsNone(QuestionCount.query.get(category.id))
+                question = Question('Seeded?', 'Yes', category.id, 1)
+                question.insert()
+                ids.append(question.id)
+                self.assertEqual(QuestionCount.query.get(category.id).total, 3)
+            finally:
+                Question.delete_many(ids)
+                category.delete()
+            self.assertEqual(Question.total(), Question.query.count())
+
+    # testing /stats follows question writes and matches a full recount
+    def test_stats(self):
+        def stats():
+            data = json.loads(self.client().get('/stats').data)
+            return data, {cat['id']: cat for cat in data['categories']}
+
+        with self.app.app_context():
+            data, categories = stats()
+            self.assertEqual(data['total_questions'], Question.query.count())
+            self.assertEqual(categories[2]['total_questions'], Question.query
+                             .filter(Question.category == 2).count())
+            before = categories[2]['difficulties'].get('1', 0)
+
+            resp = self.client().post('/questions', json=self.new_question)
+            created = json.loads(resp.data)['created_question']
+            data, categories = stats()
+            self.assertEqual(categories[2]['difficulties']['1'], before + 1)
+
+            question = Question.query.get(created['id'])
+            fives = categories[2]['difficulties'].get('5', 0)
+            question.difficulty = 5
+            question.update()
+            data, categories = stats()
+            self.assertEqual(categories[2]['difficulties'].get('1', 0), before)
+            self.assertEqual(categories[2]['difficulties']['5'], fives + 1)
+
+            question.delete()
+            self.assertEqual(QuestionStat.rebuild(), Question.query.count())
+            self.assertEqual(stats()[1][2]['difficulties'].get('1', 0), before)
+
+    # testing an edit of an expired question moves it out of its old
+    # category and difficulty everywhere
+    def test_update_expired_question(self):
+        def stats():
+            data = json.loads(self.client().get('/stats').data)
+            return {cat['id']: cat['difficulties'] for cat in data['categories']}
+
+        def quiz(category, difficulty, excluded):
+            resp = self.client().post('/quizzes', json={
+                'previous_questions': excluded,
+                'quiz_category': {'type': 'any', 'id': category},
+                'difficulty': difficulty})
+            return json.loads(resp.data)['question']
+
+        with self.app.app_context():
+            question = Question('Moved?', 'Yes', 1, 1)
+            question.insert()
+            question_id = question.id
+            # another commit expires the instance before it is edited
+            other = Question('Other?', 'Yes', 4, 4)
+            other.insert()
+            others = [row.id for row in db.session.query(Question.id).filter(
+                Question.id != question_id)]
+            self.assertEqual(quiz(1, 1, others)['id'], question_id)
+            before = stats()
+            old_total = json.loads(self.client().get(
+                '/categories/1/questions').data)['total_questions']
+
+            try:
+                question.category = 2
+                question.difficulty = 3
+                question.update()
+
+                after = stats()
+                self.assertEqual(after[1].get('1', 0), before[1]['1'] - 1)
+                self.assertEqual(after[2]['3'], before[2].get('3', 0) + 1)
+                self.assertEqual(json.loads(self.client().get(
+                    '/categories/1/questions').data)['total_questions'],
+                    old_total - 1)
+                self.assertEqual(Question.total(1), Question.query.filter(
+                    Question.category == 1).count())
+                self.assertFalse(quiz(1, 1, others))
+                self.assertEqual(quiz(2, 3, others)['id'], question_id)
+            finally:
+                Question.delete_many([question_id, other.id])
+
+    # testing /bootstrap answers categories, first page and stats at once
+    def test_bootstrap(self):
+        resp = self.client().get('/bootstrap?fields=id,category')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['categories'],
+                         json.loads(self.client().get('/categories').data)[
+                             'categories'])
+        self.assertEqual(data['total_categories'], len(data['categories']))
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(set(data['questions'][0]), {'id', 'category'})
+        self.assertEqual(data['stats']['total_questions'],
+                         data['total_questions'])
+
+        resp = self.client().get('/bootstrap?stats=0&page=1000')
+        self.assertEqual(resp.status_code, 404)
+
+    # testing /batch runs each read operation as its endpoint would
+    def test_batch_read(self):
+        resp = self.client().post('/batch', json={'operations': [
+            {'op': 'list', 'args': {'page': 2, 'include_total': False}},
+            {'op': 'category', 'category': 3},
+            {'op': 'search', 'searchTerm': 'title', 'args': {'fields': 'id'}},
+            {'op': 'stats'},
+            {'op': 'categories'},
+            {'op': 'category', 'category': 1000},
+            {'op': 'category'},
+            {'op': 'drop'}
+        ]})
+        data = json.loads(resp.data)
+        results = data['results']
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([result['status'] for result in results],
+                         [200, 200, 200, 200, 200, 404, 422, 400])
+        self.assertEqual(
+            results[0]['body']['questions'],
+            json.loads(self.client().get(
+                '/questions?page=2&include_total=0').data)['questions'])
+        self.assertNotIn('total_questions', results[0]['body'])
+        self.assertEqual(
+            results[1]['body'],
+            json.loads(self.client().get('/categories/3/questions').data))
+        self.assertNotIn('answer', results[2]['body']['questions'][0])
+        self.assertEqual(results[3]['body'],
+                         json.loads(self.client().get('/stats').data))
+        self.assertEqual(results[5]['body']['message'], 'Page not found')
+
+        resp = self.client().post('/batch', json={'operations': []})
+        self.assertEqual(resp.status_code, 422)
+
+    # testing cached results are dropped only for the written category
+    def test_result_cache_invalidation(self):
+        def assert_cache_stats(hits, misses):
+            metrics = self.client().get('/metrics').data.decode().split('\n')
+            self.assertIn('trivia_result_cache_hits_total {}'.format(hits),
+                          metrics)
+            self.assertIn('trivia_result_cache_misses_total {}'.format(
+                misses), metrics)
+
+        for _ in range(2):
+            self.client().get('/categories/2/questions')
+            self.client().get('/categories/3/questions')
+            self.client().post('/questions/search', json=self.search_term)
+        assert_cache_stats(3, 3)
+
+        # a new question in category 2 leaves category 3 cached
+        self.client().post('/questions', json=self.new_question)
+        self.client().get('/categories/3/questions')
+        assert_cache_stats(4, 3)
+
+        resp = self.client().get('/categories/2/questions?page=100')
+        self.client().get('/categories/2/questions')
+        self.client().post('/questions/search', json=self.search_term)
+        self.assertEqual(resp.status_code, 404)
+        assert_cache_stats(4, 6)
+
+    # testing a write of another worker drops the caches it made stale
+    def test_data_versions_sync(self):
+        with self.app.app_context():
+            sync_data_versions(0)
+        self.client().get('/categories/2/questions')
+        self.client().get('/categories/3/questions')
+        etag = self.client().get('/categories').headers['ETag']
+
+        # what another worker's question write in category 2 commits
+        with self.app.app_context():
+            db.engine.execute(
+                "INSERT INTO data_versions (name, version) VALUES "
+                "('questions', 1), ('category:2', 1) ON CONFLICT (name) "
+                "DO UPDATE SET version = data_versions.version + 1")
+            changed = sync_data_versions(0)
+            # this worker's own writes are not reported back to it
+            question = Question(**self.new_question)
+            question.insert()
+            question.delete()
+            self.assertEqual(sync_data_versions(0), [])
+
+        self.assertEqual(changed, ['category:2', 'questions'])
+        self.assertNotEqual(
+            self.client().get('/categories').headers['ETag'], etag)
+        metrics = self.client().get('/metrics').data.decode().split('\n')
+        self.assertIn('trivia_result_cache_invalidations_total 1', metrics)
+
+    # testing create_app takes test_config and connects on first use only
+    def test_create_app_config(self):
+        unreachable = 'postgresql://nobody@127.0.0.1:1/nowhere'
+        app = create_app({'DATABASE_URL': unreachable})
+        self.assertEqual(app.config['SQLALCHEMY_DATABASE_URI'], unreachable)
+        result = app.test_cli_runner().invoke(args=['create-schema'])
+        self.assertNotEqual(result.exit_code, 0)
+
+        result = self.app.test_cli_runner().invoke(args=['create-schema'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Created the missing tables', result.output)
+
+    # testing a warm-start snapshot is preloaded and checked on first poll
+    def test_warm_start(self):
+        path = os.path.join(tempfile.mkdtemp(), 'snapshot.json')
+        config = {'DATABASE_URL': self.database_path,
+                  'WARM_START_SNAPSHOT': path}
+        with self.app.app_context():
+            sync_data_versions(0)
+        result = self.app.test_cli_runner().invoke(
+            args=['write-snapshot', path])
+        self.assertEqual(result.exit_code, 0)
+
+        Category.invalidate_cache()
+        client = create_app(config).test_client()
+        misses = Category.cache_stats()['misses']
+        self.assertEqual(client.get('/categories').status_code, 200)
+        resp = client.post('/quizzes', json=dict(
+            self.quiz, quiz_category={'type': 'Science', 'id': 1}))
+        self.assertEqual(json.loads(resp.data)['question']['category'], 1)
+        self.assertEqual(Category.cache_stats()['misses'], misses)
+
+        # another worker wrote a category since the snapshot
+        app = create_app(config)
+        with app.app_context():
+            db.engine.execute(
+                "INSERT INTO data_versions (name, version) VALUES "
+                "('categories', 1) ON CONFLICT (name) "
+                "DO UPDATE SET version = data_versions.version + 1")
+            self.assertEqual(sync_data_versions(0), ['categories'])
+        app.test_client().get('/categories')
+        self.assertEqual(Category.cache_stats()['misses'], misses + 1)
+
     # testing error for failed question creation
     def test_405handler_creation_notAllowed(self):
         resp = self.client().post('/questions', json=self.new_question2)
@@ -146,6 +788,74 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Not Acceptable')
 
+    # testing export streams one question per line
+    def test_export_questions(self):
+        resp = self.client().get('/questions/export')
+        lines = resp.data.decode('utf-8').splitlines()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        with self.app.app_context():
+            self.assertEqual(len(lines), Question.query.count())
+        self.assertEqual(
+            sorted(json.loads(lines[0])),
+            ['answer', 'category', 'difficulty', 'id', 'question'])
+
+    # testing import inserts valid rows and reports rejected ones
+    def test_import_questions(self):
+        body = '\n'.join([
+            'question,answer,difficulty,category',
+            'Imported one?,Yes,1,2',
+            'Imported two?,Yes,2,3',
+            'No answer?,,1,2',
+            'Bad category?,Yes,1,999'
+        ])
+        with self.app.app_context():
+            before = Question.total()
+
+        resp = self.client().post('/questions/import', data=body,
+                                  content_type='text/csv')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [4, 5])
+        self.assertEqual(data['total_questions'], before + 2)
+
+    # testing importing questions from NDJSON
+    def test_import_questions_ndjson(self):
+        body = '\n'.join([
+            json.dumps({'question': 'Imported one?', 'answer': 'Yes',
+                        'difficulty': 1, 'category': 2}),
+            '{"question": "Truncated?", "answer": ',
+            json.dumps({'question': 'Imported two?', 'answer': 'Yes',
+                        'difficulty': 2, 'category': 3})
+        ])
+        with self.app.app_context():
+            before = Question.total()
+
+        resp = self.client().post('/questions/import', data=body,
+                                  content_type='application/x-ndjson')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['rejected'], 1)
+        self.assertEqual(data['errors'][0]['line'], 2)
+        self.assertEqual(data['errors'][0]['error'], 'malformed row')
+        self.assertEqual(data['total_questions'], before + 2)
+
+    # testing error to import an unsupported format
+    def test_400handler_import_questions(self):
+        resp = self.client().post('/questions/import', data='{}',
+                                  content_type='text/plain')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Bad request')
+
     # testing finding a question
     def test_find_questions(self):
         resp = self.client().post('/questions/search', json=self.search_term)
@@ -156,6 +866,61 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNotNone(data['total_questions'])
         self.assertIsNotNone(data['questions'])
 
+    # testing search ranks and highlights matches
+    def test_find_questions_highlights(self):
+        resp = self.client().post('/questions/search',
+                                  json={'searchTerm': 'CUP'})
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertIn('<mark>Cup</mark>',
+                      data['questions'][0]['highlights']['question'])
+
+    # testing search can cover answers
+    def test_find_questions_in_answers(self):
+        resp = self.client().post('/questions/search',
+                                  json={'searchTerm': 'blood'})
+        data = json.loads(resp.data)
+        self.assertEqual(data['total_questions'], 0)
+
+        resp = self.client().post('/questions/search', json={
+            'searchTerm': 'blood', 'searchAnswers': True})
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertIn('answer', data['questions'][0]['highlights'])
+
+    # testing the in-process index used when pg_trgm is not available
+    def test_trigram_index_fallback(self):
+        index = TrigramIndex()
+        with self.app.app_context():
+            ids = index.search('clay', ('question',))
+            self.assertEqual(ids, [9])
+
+            index.apply('insert', None, {
+                'id': 1001, 'question': 'Who was Clay?', 'answer': 'x'})
+            self.assertEqual(index.search('clay', ('question',)), [1001, 9])
+
+            index.apply('delete', {
+                'id': 1001, 'question': 'Who was Clay?', 'answer': 'x'}, None)
+            self.assertEqual(index.search('clay', ('question',)), [9])
+
+            # a build that a write overtook while reading is read again
+            index.clear()
+            query, reads = db.session.query, []
+
+            def overtaken(*args):
+                if not reads:
+                    index.apply('delete', {
+                        'id': 9, 'question': '', 'answer': ''}, None)
+                reads.append(args)
+                return query(*args)
+            with mock.patch.object(db.session, 'query', overtaken):
+                self.assertEqual(index.search('clay', ('question',)), [9])
+            self.assertEqual(len(reads), 2)
+
     # testing error to find a question
     def test_404handler_question_notFound(self):
         resp = self.client().post('/questions/search', json=self.search_term2)
@@ -177,6 +942,64 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNotNone(data['questions'])
         self.assertTrue(data['current_category'])
 
+    # testing questions by category are paginated
+    def test_get_questions_byCategory_paginated(self):
+        with self.app.app_context():
+            for number in range(11):
+                Question('Paged {}?'.format(number), 'Yes', 6, 1).insert()
+            total = Question.total(6)
+
+        resp = self.client().get('/categories/6/questions')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(data['total_questions'], total)
+        self.assertTrue(data['next_cursor'])
+
+    # testing streamed listings hold every matching question
+    def test_stream_questions(self):
+        resp = self.client().get('/categories/2/questions?stream=1')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), data['total_questions'])
+
+        resp = self.client().get('/questions?stream=1')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(data['questions']), data['total_questions'])
+        self.assertTrue(len(data['categories']))
+
+    # testing sparse fieldsets on listings, streams and search
+    def test_sparse_fieldsets(self):
+        resp = self.client().get('/questions?fields=question,id')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(list(data['questions'][0]), ['question', 'id'])
+        self.assertEqual(data['next_cursor'], data['questions'][-1]['id'])
+
+        resp = self.client().get('/categories/2/questions?stream=1&fields=id')
+        data = json.loads(resp.data)
+        self.assertEqual(len(data['questions']), data['total_questions'])
+        self.assertEqual(set(data['questions'][0]), {'id'})
+
+        resp = self.client().post('/questions/search?fields=answer',
+                                  json=self.search_term)
+        data = json.loads(resp.data)
+        self.assertEqual(set(data['questions'][0]), {'answer', 'highlights'})
+
+    # testing error for unknown sparse fieldset names
+    def test_400handler_unknown_fields(self):
+        resp = self.client().get('/questions?fields=id,secret')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     # testing error to get questions by category
     def test_404handler_questions_byCategory_notFound(self):
         cat = 500
@@ -195,6 +1018,45 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    # testing quizzes drawn at one difficulty or by difficulty weights
+    def test_quiz_difficulty(self):
+        quiz = dict(self.quiz, quiz_category={'type': 'click', 'id': 0})
+        for _ in range(5):
+            resp = self.client().post('/quizzes', json=dict(quiz, difficulty=4))
+            data = json.loads(resp.data)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(data['question']['difficulty'], 4)
+
+            resp = self.client().post('/quizzes', json=dict(
+                quiz, difficulty_weights={'1': 0, '2': 3, '5': 0}))
+            self.assertEqual(json.loads(resp.data)['question']['difficulty'], 2)
+
+        resp = self.client().post('/quizzes', json=dict(
+            quiz, difficulty=4, difficulty_weights={'4': 1}))
+        self.assertEqual(resp.status_code, 422)
+        resp = self.client().post('/quizzes', json=dict(
+            quiz, difficulty_weights={'4': -1}))
+        self.assertEqual(resp.status_code, 422)
+
+    # testing the sampler skips asked questions and follows writes
+    def test_quiz_sampler(self):
+        sampler = QuizSampler()
+        with self.app.app_context():
+            ids = [row.id for row in Question.query.filter_by(category=1)]
+            for _ in range(10):
+                question, remaining = sampler.draw(1, ids[1:])
+                self.assertEqual((question.id, remaining), (ids[0], 1))
+
+            question = Question(**dict(self.new_question, category=1))
+            question.insert()
+            sampler.apply('insert', None, question.format())
+            drawn, remaining = sampler.draw(1, ids)
+            self.assertEqual((drawn.id, remaining), (question.id, 1))
+
+            sampler.apply('delete', question.format(), None)
+            question.delete()
+            self.assertEqual(sampler.draw(1, ids), (None, 0))
+
     # testing error to start a quiz
     def test_422handler_error_toStart__quiz(self):
         resp = self.client().post('/quizzes', json=self.quiz2)
@@ -204,6 +1066,123 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Unprocessable resources')
 
+    # testing a quiz session walks its deck without repeats
+    def test_quiz_session(self):
+        resp = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+
+        asked = []
+        for _ in range(data['total_questions']):
+            resp = self.client().post(
+                '/quizzes/sessions/{}/next'.format(data['session_id']))
+            question = json.loads(resp.data)['question']
+            self.assertEqual(question['category'], 1)
+            asked.append(question['id'])
+        self.assertEqual(len(asked), len(set(asked)))
+
+        resp = self.client().post(
+            '/quizzes/sessions/{}/next'.format(data['session_id']))
+        self.assertEqual(json.loads(resp.data)['question'], '')
+
+    # testing error to draw from an unknown quiz session
+    def test_404handler_quiz_session_notFound(self):
+        resp = self.client().post('/quizzes/sessions/nope/next')
+        data = json.loads(resp.data)
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Page not found')
+
+
+def asgi_as_wsgi(asgi_app):
+    # drives an ASGI app from the WSGI test client, one event loop per request
+    def wsgi_app(environ, start_response):
+        headers = [(key[5:].lower().replace('_', '-').encode('latin-1'),
+                    value.encode('latin-1'))
+                   for key, value in environ.items()
+                   if key.startswith('HTTP_') and key[5:] not in (
+                       'CONTENT_TYPE', 'CONTENT_LENGTH')]
+        for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if environ.get(key):
+                headers.append((key.lower().replace('_', '-').encode(),
+                                environ[key].encode('latin-1')))
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'scheme': environ['wsgi.url_scheme'],
+            'root_path': '',
+            'method': environ['REQUEST_METHOD'],
+            'path': environ['PATH_INFO'],
+            'query_string': environ['QUERY_STRING'].encode('latin-1'),
+            'headers': headers,
+            'server': (environ['SERVER_NAME'], int(environ['SERVER_PORT'])),
+            'client': (environ.get('REMOTE_ADDR'),
+                       int(environ.get('REMOTE_PORT') or 0))
+        }
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        requests = [{'type': 'http.request',
+                     'body': environ['wsgi.input'].read(length)}]
+        messages = []
+
+        async def receive():
+            return requests.pop(0)
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi_app(scope, receive, send))
+        start = messages[0]
+        start_response('{} -'.format(start['status']), [
+            (name.decode('latin-1'), value.decode('latin-1'))
+            for name, value in start['headers']])
+        return [message['body'] for message in messages[1:]]
+    return wsgi_app
+
+
+@unittest.skipIf(AsgiAdapter is None, 'a2wsgi is not installed')
+class AsgiTriviaTestCase(TriviaTestCase):
+    """Runs every trivia test again through the ASGI adapter"""
+
+    def setUp(self):
+        super().setUp()
+        self.adapter = AsgiAdapter(self.app.wsgi_app, threads=2)
+        self.app.wsgi_app = asgi_as_wsgi(self.adapter)
+
+    def tearDown(self):
+        self.adapter.close()
+
+    # testing lifespan shutdown waits for the ASGI worker threads without
+    # blocking the event loop a streamed response still writes through
+    def test_asgi_lifespan_shutdown(self):
+        adapter = AsgiAdapter(self.app.wsgi_app, threads=1)
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        async def serve():
+            loop = asyncio.get_running_loop()
+            chunk = adapter.executor.submit(
+                lambda: asyncio.run_coroutine_threadsafe(
+                    asyncio.sleep(0.1), loop).result())
+            await asyncio.wait_for(
+                adapter({'type': 'lifespan'}, receive, send), 5)
+            return chunk.done()
+
+        self.assertTrue(asyncio.run(serve()))
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":